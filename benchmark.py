@@ -0,0 +1,461 @@
+"""
+Offline benchmark for the music bot.
+
+Drives the real command handlers in music_bot.py against in-process stand-ins:
+a fake Lavalink REST/WebSocket server, a stub Spotify client and synthetic
+Discord guilds, channels and members. Nothing talks to the network.
+
+    python benchmark.py --guilds 50 --users 5 --playlist-size 500
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import contextlib
+import tempfile
+import tracemalloc
+from types import SimpleNamespace
+
+from aiohttp import web
+
+# Keep every file the bot writes in a scratch directory and switch off the metrics endpoint.
+BENCH_DIR = tempfile.mkdtemp(prefix="musicbot-bench-")  # Scratch directory for the bot's databases.
+os.environ.setdefault("CACHE_DB", os.path.join(BENCH_DIR, "track_cache.db"))
+os.environ.setdefault("SETTINGS_DB", os.path.join(BENCH_DIR, "settings.db"))
+os.environ.setdefault("SESSION_DB", os.path.join(BENCH_DIR, "sessions.db"))
+os.environ.setdefault("LAVALINK_NODES_FILE", os.path.join(BENCH_DIR, "nodes.json"))  # Missing on purpose, so LAVALINK_URI is used.
+os.environ["METRICS_PORT"] = "0"  # Never bind the real metrics port.
+os.environ["SNAPSHOT_INTERVAL"] = "3600"  # Session snapshots are not part of the benchmark.
+os.environ.pop("SHARD_COUNT", None)
+os.environ.pop("SHARDED", None)
+
+import discord
+import wavelink
+import music_bot
+
+##############################
+# Fake Lavalink
+##############################
+class FakeLavalink:
+    """
+    Minimal Lavalink v4 server: the websocket handshake, track searches and player
+    updates, with TrackStart/TrackEnd events sent back the way Lavalink would.
+    """
+
+    def __init__(self, search_latency: float = 0.05):
+        self.search_latency = search_latency  # Seconds every /loadtracks request takes.
+        self.session_id = uuid.uuid4().hex  # Session handed out in the ready op.
+        self.socket = None  # Websocket of the connected node.
+        self.tracks = {}  # Maps encoded track -> track payload.
+        self.playing = {}  # Maps guild ID -> encoded track currently playing.
+        self.user_data = {}  # Maps guild ID -> user data sent with the playing track.
+        self.starts = {}  # Maps guild ID -> times tracks started playing.
+        self.started = asyncio.Condition()  # Notified whenever a track starts.
+        self.searches = 0  # Number of /loadtracks requests served.
+        self.runner = None  # aiohttp runner that owns the server.
+        self.uri = None  # Base URI, known once the server listens.
+
+    async def start(self):
+        app = web.Application()  # Routes used by wavelink.
+        app.router.add_get("/v4/websocket", self.websocket)
+        app.router.add_get("/v4/info", self.info)
+        app.router.add_get("/v4/stats", self.stats)
+        app.router.add_get("/v4/loadtracks", self.loadtracks)
+        app.router.add_patch("/v4/sessions/{session}", self.update_session)
+        app.router.add_patch("/v4/sessions/{session}/players/{guild}", self.update_player)
+        app.router.add_delete("/v4/sessions/{session}/players/{guild}", self.destroy_player)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)  # Any free port.
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # The port the OS picked.
+        self.uri = f"http://127.0.0.1:{port}"
+
+    async def close(self):
+        if self.socket is not None:
+            await self.socket.close()
+        await self.runner.cleanup()
+
+    def make_track(self, query: str, index: int) -> dict:
+        identifier = uuid.uuid5(uuid.NAMESPACE_URL, f"{query}#{index}").hex[:11]  # Stable ID per query and result.
+        track = {
+            "encoded": f"enc-{identifier}",
+            "info": {"identifier": identifier, "isSeekable": True, "author": "Benchmark Artist", "length": 180000, "isStream": False, "position": 0, "title": f"{query} ({index})", "uri": f"https://www.youtube.com/watch?v={identifier}", "artworkUrl": None, "isrc": None, "sourceName": "youtube"},
+            "pluginInfo": {},
+            "userData": {},
+        }
+        self.tracks[track["encoded"]] = track  # Remember it so events can send the full payload.
+        return track
+
+    async def send_event(self, guild_id: str, event_type: str, encoded: str, **fields):
+        if self.socket is not None and not self.socket.closed:
+            track = dict(self.tracks[encoded], userData=self.user_data.get(guild_id, {}))  # Lavalink echoes the user data back.
+            await self.socket.send_json({"op": "event", "type": event_type, "guildId": guild_id, "track": track, **fields})
+
+    async def websocket(self, request: web.Request) -> web.WebSocketResponse:
+        self.socket = web.WebSocketResponse()
+        await self.socket.prepare(request)
+        await self.socket.send_json({"op": "ready", "resumed": False, "sessionId": self.session_id})  # Finish the handshake.
+        async for _ in self.socket:
+            pass  # Clients never send anything meaningful.
+        return self.socket
+
+    async def info(self, request: web.Request) -> web.Response:
+        return web.json_response({"version": {"semver": "4.0.0", "major": 4, "minor": 0, "patch": 0, "preRelease": None, "build": None}, "buildTime": 0, "git": {"branch": "main", "commit": "0", "commitTime": 0}, "jvm": "21", "lavaplayer": "2", "sourceManagers": ["youtube"], "filters": [], "plugins": []})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"players": len(self.starts), "playingPlayers": len(self.playing), "uptime": 1, "memory": {"free": 1, "used": 1, "allocated": 1, "reservable": 1}, "cpu": {"cores": 4, "systemLoad": 0.1, "lavalinkLoad": 0.05}})
+
+    async def loadtracks(self, request: web.Request) -> web.Response:
+        self.searches += 1  # Count the search.
+        await asyncio.sleep(self.search_latency)  # Simulate YouTube search time.
+        query = request.query["identifier"].split(":", 1)[-1]  # Drop the ytsearch: prefix.
+        return web.json_response({"loadType": "search", "data": [self.make_track(query, index) for index in range(5)]})
+
+    async def update_session(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        return web.json_response({"resuming": data.get("resuming", False), "timeout": data.get("timeout", 60)})
+
+    async def update_player(self, request: web.Request) -> web.Response:
+        guild_id = request.match_info["guild"]
+        data = await request.json()
+        if "track" in data:
+            encoded = data["track"].get("encoded")  # None stops the player.
+            current = self.playing.get(guild_id)  # Track that is playing right now.
+            if encoded is None:
+                if current is not None:
+                    del self.playing[guild_id]
+                    await self.send_event(guild_id, "TrackEndEvent", current, reason="stopped")  # Same as a real skip.
+            elif current is None or request.query.get("noReplace") != "True":
+                if current is not None:
+                    await self.send_event(guild_id, "TrackEndEvent", current, reason="replaced")
+                self.playing[guild_id] = encoded
+                self.user_data[guild_id] = data["track"].get("userData", {})
+                async with self.started:
+                    self.starts.setdefault(guild_id, []).append(time.perf_counter())  # Audio would start flowing now.
+                    self.started.notify_all()
+                await self.send_event(guild_id, "TrackStartEvent", encoded)
+        encoded = self.playing.get(guild_id)
+        return web.json_response({"guildId": guild_id, "track": self.tracks.get(encoded), "volume": data.get("volume", 100), "paused": data.get("paused", False), "state": {"time": 0, "position": 0, "connected": True, "ping": 0}, "voice": {"token": "", "endpoint": "", "sessionId": ""}, "filters": {}})
+
+    async def destroy_player(self, request: web.Request) -> web.Response:
+        self.playing.pop(request.match_info["guild"], None)  # The player is gone, silently.
+        return web.Response(status=204)
+
+    async def wait_for_start(self, guild_id: int, count: int, timeout: float = 30.0) -> float:
+        """Wait until the guild has started `count` tracks and return when the last of them started."""
+        async with self.started:
+            await asyncio.wait_for(self.started.wait_for(lambda: len(self.starts.get(str(guild_id), [])) >= count), timeout)
+            return self.starts[str(guild_id)][count - 1]
+
+##############################
+# Stub Spotify
+##############################
+class StubSpotify:
+    """Stands in for spotipy.Spotify. Methods block for `latency` seconds like real HTTP calls."""
+
+    def __init__(self, latency: float = 0.1, playlist_size: int = 500):
+        self.latency = latency  # Seconds every API call takes.
+        self.playlist_size = playlist_size  # Tracks in every playlist and album.
+        self.calls = 0  # Number of API calls served.
+
+    def _wait(self):
+        self.calls += 1
+        time.sleep(self.latency)  # spotipy blocks its thread for the whole request.
+
+    @staticmethod
+    def _track(track_id: str) -> dict:
+        return {"id": track_id, "name": f"Song {track_id}", "artists": [{"name": "Spotify Artist"}]}
+
+    def _page(self, spotify_id: str, limit: int, offset: int, wrap: bool) -> dict:
+        tracks = [self._track(f"{spotify_id}-{index}") for index in range(offset, min(offset + limit, self.playlist_size))]
+        return {"items": [{"track": track} for track in tracks] if wrap else tracks, "total": self.playlist_size}
+
+    def track(self, track_id: str) -> dict:
+        self._wait()
+        return self._track(track_id)
+
+    def tracks(self, track_ids: list) -> dict:
+        self._wait()
+        return {"tracks": [self._track(track_id) for track_id in track_ids]}
+
+    def playlist_items(self, playlist_id: str, limit: int = 100, offset: int = 0, additional_types=("track",)) -> dict:
+        self._wait()
+        return self._page(playlist_id, limit, offset, wrap=True)
+
+    def album_tracks(self, album_id: str, limit: int = 50, offset: int = 0) -> dict:
+        self._wait()
+        return self._page(album_id, limit, offset, wrap=False)
+
+    def artist_top_tracks(self, artist_id: str) -> dict:
+        self._wait()
+        return {"tracks": [self._track(f"{artist_id}-{index}") for index in range(10)]}
+
+##############################
+# Synthetic Discord
+##############################
+class FakeMessage:
+    async def add_reaction(self, emoji):
+        pass
+
+    async def remove_reaction(self, emoji, member):
+        pass
+
+    async def edit(self, **kwargs):
+        pass
+
+class FakeTextChannel:
+    def __init__(self, channel_id: int, guild):
+        self.id = channel_id
+        self.guild = guild
+        self.mention = f"<#{channel_id}>"
+        self.sent = 0  # Messages sent to this channel.
+
+    async def send(self, content=None, **kwargs) -> FakeMessage:
+        self.sent += 1
+        return FakeMessage()
+
+class FakeVoiceChannel:
+    def __init__(self, bot, channel_id: int, guild):
+        self.bot = bot
+        self.id = channel_id
+        self.guild = guild
+        self.name = f"voice-{channel_id}"
+        self.mention = f"<#{channel_id}>"
+        self.rtc_region = None
+        self.members = []  # Members connected to the channel.
+
+    def _get_voice_client_key(self):
+        return self.guild.id, "guild_id"
+
+    async def connect(self, *, cls, timeout: float = 60.0, reconnect: bool = True, **kwargs):
+        """Connect like discord.VoiceChannel.connect, with the gateway's voice events answered locally."""
+        if self.guild.voice_client is not None:
+            raise discord.ClientException("Already connected to a voice channel.")
+        player = cls(self.bot, self)  # Same call discord.py makes.
+        self.bot._connection._add_voice_client(self.guild.id, player)
+        try:
+            await player.connect(timeout=timeout, reconnect=reconnect)
+        except BaseException:
+            player.cleanup()
+            raise
+        return player
+
+class FakeGuild:
+    def __init__(self, bot, guild_id: int):
+        self.bot = bot
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+        self.text_channel = FakeTextChannel(guild_id * 10 + 1, self)
+        self.voice_channel = FakeVoiceChannel(bot, guild_id * 10 + 2, self)
+
+    @property
+    def voice_client(self):
+        return self.bot._connection._get_voice_client(self.id)
+
+    def get_channel(self, channel_id: int):
+        return {self.text_channel.id: self.text_channel, self.voice_channel.id: self.voice_channel}.get(channel_id)
+
+    def get_role(self, role_id: int):
+        return None
+
+    async def change_voice_state(self, *, channel, self_mute: bool = False, self_deaf: bool = False):
+        """Answer a voice state change with the VOICE_STATE_UPDATE and VOICE_SERVER_UPDATE Discord would send."""
+        player = self.voice_client
+        if channel is None or player is None:
+            return  # Leaving needs no reply.
+        await player.on_voice_state_update({"guild_id": str(self.id), "channel_id": str(channel.id), "session_id": uuid.uuid4().hex, "user_id": str(self.bot.user.id)})
+        await player.on_voice_server_update({"guild_id": str(self.id), "token": "benchmark", "endpoint": "benchmark.invalid"})
+
+class FakeContext:
+    """Enough of commands.Context for the music commands."""
+
+    def __init__(self, guild: FakeGuild, user_id: int):
+        self.guild = guild
+        self.channel = guild.text_channel
+        self.author = SimpleNamespace(id=user_id, bot=False, roles=[], guild_permissions=SimpleNamespace(manage_guild=False), voice=SimpleNamespace(channel=guild.voice_channel))
+        guild.voice_channel.members.append(self.author)  # Every user listens in the guild's voice channel.
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+
+    async def send(self, content=None, **kwargs) -> FakeMessage:
+        return await self.channel.send(content, **kwargs)
+
+##############################
+# Benchmark
+##############################
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]  # Nearest-rank percentile.
+
+class Recorder:
+    """Times command handlers and counts the ones that raise."""
+
+    def __init__(self):
+        self.latencies = {}  # Maps command name -> list of durations in seconds.
+        self.errors = {}  # Maps command name -> number of exceptions.
+
+    async def run(self, name: str, coro):
+        started = time.perf_counter()
+        try:
+            await coro
+        except Exception as e:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            print(f"{name} failed: {e!r}", file=sys.stderr)
+        finally:
+            self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+
+async def user_session(recorder: Recorder, lavalink: FakeLavalink, ctx: FakeContext, user_index: int, songs: int):
+    """One user adding songs, looking at the queue and skipping."""
+    for song in range(songs):
+        query = f"benchmark song {random.randrange(songs * 20)}"  # Overlapping queries exercise the track cache.
+        await recorder.run("play", music_bot.play.callback(ctx, query=query))
+    await recorder.run("queue", music_bot.queue_cmd.callback(ctx))
+    if user_index == 0:
+        started = len(lavalink.starts.get(str(ctx.guild.id), []))  # Tracks started before the skip.
+        skip_started = time.perf_counter()
+        await recorder.run("skip", music_bot.skip.callback(ctx))
+        try:
+            next_audio = await lavalink.wait_for_start(ctx.guild.id, started + 1)  # on_wavelink_track_end plays the next song.
+        except asyncio.TimeoutError:
+            recorder.errors["skip_to_next_audio"] = recorder.errors.get("skip_to_next_audio", 0) + 1
+        else:
+            recorder.latencies.setdefault("skip_to_next_audio", []).append(next_audio - skip_started)
+
+async def guild_session(recorder: Recorder, lavalink: FakeLavalink, guild: FakeGuild, users: int, songs: int):
+    contexts = [FakeContext(guild, guild.id * 1000 + index) for index in range(users)]
+    await recorder.run("play", music_bot.play.callback(contexts[0], query="benchmark opener"))  # Someone starts the session...
+    await asyncio.gather(*(user_session(recorder, lavalink, ctx, index, songs) for index, ctx in enumerate(contexts)))  # ...and everyone piles on.
+
+async def playlist_first_audio(recorder: Recorder, lavalink: FakeLavalink, guild: FakeGuild) -> float:
+    """Seconds from `play <playlist>` until the first playlist track reaches Lavalink."""
+    ctx = FakeContext(guild, guild.id * 1000)
+    started = time.perf_counter()
+    await recorder.run("play_playlist", music_bot.play.callback(ctx, query=f"https://open.spotify.com/playlist/bench{guild.id}"))
+    return await lavalink.wait_for_start(guild.id, 1) - started
+
+async def benchmark(args) -> dict:
+    lavalink = FakeLavalink(search_latency=args.search_latency)
+    await lavalink.start()
+    os.environ["LAVALINK_URI"] = lavalink.uri  # load_node_configs falls back to this.
+
+    spotify = StubSpotify(latency=args.spotify_latency, playlist_size=args.playlist_size)
+    bot = music_bot.create_bot(spotify=spotify)
+    bot._connection.user = SimpleNamespace(id=424242, name="benchmark", bot=True)  # wavelink sends our user ID to Lavalink.
+    guilds = {}  # Maps guild ID -> FakeGuild.
+
+    def get_channel(channel_id: int):
+        guild = guilds.get(channel_id // 10)  # Channel IDs are derived from their guild's ID.
+        return guild.get_channel(channel_id) if guild else None
+    bot.get_channel = get_channel
+    bot.get_guild = guilds.get
+
+    async with bot:  # Sets up the loop that discord.py dispatches events on.
+        started = time.perf_counter()
+        await music_bot.setup_hook()  # Connect to the fake Lavalink the same way the bot does.
+        setup_hook_time = time.perf_counter() - started
+        if not await music_bot.wait_for_node(10):
+            raise RuntimeError(f"Could not connect to the fake Lavalink server at {lavalink.uri}.")
+        node_ready_time = time.perf_counter() - started
+
+        recorder = Recorder()
+        tracemalloc.start()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        for guild_id in range(1, args.guilds + 1):
+            guilds[guild_id] = FakeGuild(bot, guild_id)
+        await asyncio.gather(*(guild_session(recorder, lavalink, guild, args.users, args.songs) for guild in guilds.values()))
+        elapsed = time.perf_counter() - started
+        memory_per_guild = (tracemalloc.get_traced_memory()[0] - memory_before) / max(args.guilds, 1)  # Players, queues and caches they left behind.
+        tracemalloc.stop()
+
+        playlist_guild = guilds[args.guilds + 1] = FakeGuild(bot, args.guilds + 1)
+        first_audio = await playlist_first_audio(recorder, lavalink, playlist_guild)
+
+        commands_run = sum(len(values) for name, values in recorder.latencies.items() if name != "skip_to_next_audio")
+        report = {
+            "guilds": args.guilds,
+            "users_per_guild": args.users,
+            "playlist_size": args.playlist_size,
+            "search_latency": args.search_latency,
+            "spotify_latency": args.spotify_latency,
+            "commands": commands_run,
+            "elapsed": elapsed,
+            "throughput": commands_run / elapsed if elapsed else 0.0,
+            "latency": {name: {"count": len(values), "p50": percentile(values, 0.5), "p99": percentile(values, 0.99), "max": max(values)} for name, values in sorted(recorder.latencies.items())},
+            "errors": recorder.errors,
+            "setup_hook": setup_hook_time,
+            "node_ready": node_ready_time,
+            "playlist_first_audio": first_audio,
+            "memory_per_guild": memory_per_guild,
+            "lavalink_searches": lavalink.searches,
+            "spotify_calls": spotify.calls,
+            "track_cache_hit_ratio": music_bot.track_cache.hit_ratio(),
+        }
+
+        for player in list(bot.voice_clients):
+            await player.disconnect()  # Tear the players down before the loop closes.
+        await wavelink.Pool.close()
+        await lavalink.close()
+        await music_bot.guild_settings.close()
+    return report
+
+def print_report(report: dict):
+    print(f"{report['guilds']} guilds x {report['users_per_guild']} users, search latency {report['search_latency'] * 1000:.0f} ms, Spotify latency {report['spotify_latency'] * 1000:.0f} ms")
+    print(f"Startup: setup hook {report['setup_hook'] * 1000:.1f} ms, first node ready {report['node_ready'] * 1000:.1f} ms")
+    print(f"Commands: {report['commands']} in {report['elapsed']:.2f}s ({report['throughput']:.1f}/s)")
+    print(f"{'command':<20}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, stats in report["latency"].items():
+        print(f"{name:<20}{stats['count']:>8}{stats['p50'] * 1000:>10.1f}{stats['p99'] * 1000:>10.1f}{stats['max'] * 1000:>10.1f}")
+    print(f"Time to first audio ({report['playlist_size']}-track playlist): {report['playlist_first_audio'] * 1000:.1f} ms")
+    print(f"Memory per guild: {report['memory_per_guild'] / 1024:.1f} KiB")
+    print(f"Lavalink searches: {report['lavalink_searches']}, Spotify calls: {report['spotify_calls']}, track cache hit ratio: {report['track_cache_hit_ratio']:.1%}")
+    if report["errors"]:
+        print(f"Errors: {report['errors']}")
+
+def check_thresholds(report: dict, args) -> list:
+    """Return a description of every threshold the run missed."""
+    failures = []
+    if args.max_p99 is not None:
+        failures += [f"{name} p99 {stats['p99'] * 1000:.1f} ms > {args.max_p99 * 1000:.1f} ms" for name, stats in report["latency"].items() if stats["p99"] > args.max_p99]
+    if args.max_first_audio is not None and report["playlist_first_audio"] > args.max_first_audio:
+        failures.append(f"time to first audio {report['playlist_first_audio'] * 1000:.1f} ms > {args.max_first_audio * 1000:.1f} ms")
+    if args.min_throughput is not None and report["throughput"] < args.min_throughput:
+        failures.append(f"throughput {report['throughput']:.1f}/s < {args.min_throughput:.1f}/s")
+    if report["errors"]:
+        failures.append(f"errors: {report['errors']}")
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark for the music bot.")
+    parser.add_argument("--guilds", type=int, default=20, help="Number of simulated guilds.")
+    parser.add_argument("--users", type=int, default=5, help="Concurrent users per guild.")
+    parser.add_argument("--songs", type=int, default=3, help="Songs each user adds.")
+    parser.add_argument("--playlist-size", type=int, default=500, help="Tracks in the Spotify playlist used for time to first audio.")
+    parser.add_argument("--search-latency", type=float, default=0.05, help="Seconds every Lavalink search takes.")
+    parser.add_argument("--spotify-latency", type=float, default=0.1, help="Seconds every Spotify API call takes.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the search queries.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    parser.add_argument("--max-p99", type=float, help="Fail if any command's p99 latency exceeds this many seconds.")
+    parser.add_argument("--max-first-audio", type=float, help="Fail if time to first audio exceeds this many seconds.")
+    parser.add_argument("--min-throughput", type=float, help="Fail if fewer commands per second complete.")
+    args = parser.parse_args()
+    random.seed(args.seed)
+    with contextlib.redirect_stdout(sys.stderr) if args.json else contextlib.nullcontext():
+        report = asyncio.run(benchmark(args))  # Keep the bot's own logging out of the JSON report.
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    failures = check_thresholds(report, args)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
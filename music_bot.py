@@ -1,5 +1,21 @@
 import os  # Import the os module for environment variable and file operations.
+import sys  # Import sys to locate the Python interpreter for cluster workers.
+import signal  # Import signal to stop cluster workers cleanly.
+import argparse  # Import argparse for the cluster launcher's command line.
+import subprocess  # Import subprocess to start cluster worker processes.
+import urllib.request  # Import urllib.request to ask Discord for the recommended shard count.
+import bisect  # Import bisect to find histogram buckets.
+from aiohttp import web  # Import aiohttp's web server for the metrics endpoint.
+import asyncio  # Import asyncio for concurrent task scheduling.
+import contextlib  # Import contextlib for async context helpers.
+from dataclasses import dataclass  # Import dataclass for lightweight record types.
 import json  # Import json for handling JSON data.
+import time  # Import time for cache expiry timestamps.
+import sqlite3  # Import sqlite3 for the on-disk track cache.
+import threading  # Import threading to guard the shared SQLite connection.
+import functools  # Import functools to bind arguments for executor calls.
+from concurrent.futures import ThreadPoolExecutor  # Import ThreadPoolExecutor to run blocking Spotify calls.
+from collections import OrderedDict, deque  # Import OrderedDict for the in-memory LRU cache and deque for send queues.
 import urllib.parse  # Import urllib.parse to parse URLs.
 import discord  # Import discord.py library for Discord API.
 from discord.ext import commands  # Import commands extension from discord.py.
@@ -7,6 +23,9 @@ from dotenv import load_dotenv  # Import load_dotenv to load environment variabl
 import wavelink  # Import wavelink for Lavalink (music) functionality.
 import spotipy  # Import spotipy for Spotify API interactions.
 from spotipy.oauth2 import SpotifyClientCredentials  # Import SpotifyClientCredentials for Spotify API authentication.
+from spotipy.exceptions import SpotifyException, SpotifyOauthError  # Import Spotify API and authentication errors.
+import requests  # Import requests (spotipy's HTTP library) to configure Spotify retries.
+from urllib3.util.retry import Retry  # Import Retry to control which Spotify responses are retried in the worker thread.
 
 # Load tokens and credentials from .env file
 load_dotenv()  # Load environment variables from the .env file.
@@ -14,33 +33,519 @@ DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")  # Get the Discord bot token from env
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")  # Get the Spotify client ID from environment variables.
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")  # Get the Spotify client secret from environment variables.
 # Spotify credentials are used by Lavalink if configured appropriately in your Lavalink config
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "5"))  # Maximum number of Lavalink searches in flight per playlist.
+SEARCH_RETRIES = int(os.getenv("SEARCH_RETRIES", "2"))  # Extra attempts before giving up on a failing search for the next track.
+PREFETCH_WINDOW = int(os.getenv("PREFETCH_WINDOW", "3"))  # Number of upcoming queue entries to resolve ahead of playback.
+LAVALINK_NODES_FILE = os.getenv("LAVALINK_NODES_FILE", "nodes.json")  # JSON file listing Lavalink nodes (uri, password, identifier, regions, roles).
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None  # Total number of shards across all clusters (None lets Discord decide).
+SHARD_IDS = [int(shard) for shard in os.getenv("SHARD_IDS", "").split(",") if shard.strip()] or None  # Shards run by this process.
+CLUSTER_ID = os.getenv("CLUSTER_ID")  # Name of this cluster when started by the launcher.
+SHARDED = os.getenv("SHARDED", "").lower() in ("1", "true", "yes") or SHARD_COUNT is not None  # Run an AutoShardedBot instead of a single-shard Bot.
+SETTINGS_BACKEND = os.getenv("SETTINGS_BACKEND", "sqlite")  # Guild settings storage: "sqlite" (default) or "json".
+SETTINGS_DB = os.getenv("SETTINGS_DB", "settings.db")  # SQLite file used by the sqlite settings backend.
+SETTINGS_FLUSH_INTERVAL = float(os.getenv("SETTINGS_FLUSH_INTERVAL", "2"))  # Seconds to collect settings changes before writing them.
+SESSION_DB = os.getenv("SESSION_DB", "sessions.db")  # SQLite file holding player snapshots for resuming after a restart.
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "15"))  # Seconds between player snapshots.
+RESUME_RATE = float(os.getenv("RESUME_RATE", "2"))  # Voice channels rejoined per second when restoring sessions.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")  # Interface the metrics endpoint listens on.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))  # Port of the Prometheus metrics endpoint (0 disables it); clusters add their cluster ID.
+NODE_STATS_INTERVAL = int(os.getenv("NODE_STATS_INTERVAL", "30"))  # Seconds between Lavalink stats polls used for node selection.
+SPOTIFY_WORKERS = int(os.getenv("SPOTIFY_WORKERS", "4"))  # Threads available for blocking Spotify API calls.
+SPOTIFY_MAX_RETRIES = int(os.getenv("SPOTIFY_MAX_RETRIES", "5"))  # Attempts made after Spotify answers 429 Too Many Requests.
+CACHE_DB = os.getenv("CACHE_DB", "track_cache.db")  # SQLite file backing the persistent track cache.
+CACHE_TTL = int(os.getenv("CACHE_TTL", str(7 * 24 * 3600)))  # Seconds a cached resolution stays valid.
+CACHE_MEMORY_SIZE = int(os.getenv("CACHE_MEMORY_SIZE", "1000"))  # Maximum number of entries kept in memory.
+CACHE_DISK_SIZE = int(os.getenv("CACHE_DISK_SIZE", "50000"))  # Maximum number of entries kept on disk.
+DISPATCH_DELAY = float(os.getenv("DISPATCH_DELAY", "0.05"))  # Seconds to let a burst of embeds gather before sending them as one message.
+RESOLVE_CONCURRENCY = int(os.getenv("RESOLVE_CONCURRENCY", "20"))  # Maximum number of resolution jobs in flight across all guilds.
+USER_RATE_LIMIT = int(os.getenv("USER_RATE_LIMIT", "5"))  # Commands each user may run per RATE_LIMIT_PERIOD.
+GUILD_RATE_LIMIT = int(os.getenv("GUILD_RATE_LIMIT", "20"))  # Commands each guild may run per RATE_LIMIT_PERIOD.
+RATE_LIMIT_PERIOD = float(os.getenv("RATE_LIMIT_PERIOD", "10"))  # Length of the command rate-limit window in seconds.
+PRELOAD_SECONDS = float(os.getenv("PRELOAD_SECONDS", "20"))  # Make sure the next track is ready this many seconds before the current one ends.
+IDLE_TIMEOUT = int(os.getenv("IDLE_TIMEOUT", "120"))  # Seconds to stay in voice after the queue runs out (0 leaves right away).
+EMPTY_CHANNEL_TIMEOUT = int(os.getenv("EMPTY_CHANNEL_TIMEOUT", "30"))  # Seconds to stay in a voice channel nobody is listening in.
+NODE_WAIT_TIMEOUT = float(os.getenv("NODE_WAIT_TIMEOUT", "15"))  # Seconds a command waits for a Lavalink node while nodes are still connecting.
+NODE_RETRY_MAX = float(os.getenv("NODE_RETRY_MAX", "60"))  # Longest wait between attempts to add a Lavalink node that refused the connection.
+startup_started = time.perf_counter()  # Startup phases are timed from here.
 
-# Set up spotipy client for Spotify API calls.
-spotify_auth = SpotifyClientCredentials(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET)  # Initialize Spotify authentication.
-sp = spotipy.Spotify(auth_manager=spotify_auth)  # Create a Spotify client instance using the authentication manager.
+sp = None  # Spotify client, created on first use (or injected by create_bot).
+spotify_executor = ThreadPoolExecutor(max_workers=SPOTIFY_WORKERS, thread_name_prefix="spotify")  # Worker threads for spotipy's blocking HTTP calls.
 
-# Intents setup (ensure "message_content" is enabled in your Developer Portal)
-intents = discord.Intents.default()  # Get the default intents for the bot.
-intents.message_content = True  # Enable access to message content (must be enabled in the Developer Portal).
-intents.voice_states = True  # Enable access to voice state updates.
+bot = None  # The running bot, set by create_bot.
 
-bot = commands.Bot(command_prefix="b!", intents=intents)  # Create a new bot instance with specified prefix and intents.
+def owns_guild(guild_id) -> bool:
+    """Whether the guild is served by one of this process's shards."""
+    if not SHARD_IDS or not SHARD_COUNT:
+        return True  # A single process serves every guild.
+    return (int(guild_id) >> 22) % SHARD_COUNT in SHARD_IDS  # Discord's shard assignment formula.
 
-# Volume settings file and helper functions for persistence.
-volumes_file = "volumes.json"  # Define the file name where volume settings are stored.
+##############################
+# Guild settings store
+##############################
+volumes_file = f"volumes.cluster{CLUSTER_ID}.json" if CLUSTER_ID else "volumes.json"  # JSON settings file; each cluster keeps its own guilds.
+DEFAULT_SETTINGS = {"volume": None, "text_channel_id": None}  # Settings every guild starts with; add a key here to store a new setting.
 
-def load_volumes():
+def read_volumes_file(path: str) -> dict:
+    """Read one volumes.json-style file ({guild_id: volume or settings}), or None if it doesn't exist."""
     try:
-        with open(volumes_file, "r") as f:  # Try opening the volumes file in read mode.
-            return json.load(f)  # Return the loaded JSON data as a dictionary.
+        with open(path, "r") as f:  # Try opening the volumes file in read mode.
+            return json.load(f)  # Load the JSON data as a dictionary.
     except FileNotFoundError:
-        return {}  # If the file doesn't exist, return an empty dictionary.
+        return None
+
+def load_legacy_volumes() -> dict:
+    """Read volumes.json as written by older versions ({guild_id: volume}), keeping only this cluster's guilds."""
+    for path in (volumes_file, "volumes.json"):
+        data = read_volumes_file(path)  # Try the next candidate file.
+        if data is not None:
+            return {guild_id: value for guild_id, value in data.items() if owns_guild(guild_id)}  # Keep only this cluster's guilds.
+    return {}  # If no file exists, return an empty dictionary.
+
+class SQLiteSettingsBackend:
+    """Stores one row per guild in SQLite; each flush is a single transaction."""
+
+    def __init__(self, path: str):
+        self.path = path  # Location of the SQLite database.
+        self._db = None  # Connection, opened on first use from the worker thread.
+        self._lock = threading.Lock()  # Serialize access from worker threads.
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)  # Wait for other clusters' writes instead of failing.
+            self._db.execute("PRAGMA journal_mode=WAL")  # Crash-safe writes that don't block readers.
+            self._db.execute("CREATE TABLE IF NOT EXISTS guild_settings (guild_id TEXT PRIMARY KEY, data TEXT NOT NULL)")  # Create the table on first run.
+            self._db.execute("CREATE TABLE IF NOT EXISTS legacy_imports (path TEXT PRIMARY KEY)")  # volumes.json files already imported.
+            for path in (volumes_file, "volumes.json"):
+                if self._db.execute("SELECT 1 FROM legacy_imports WHERE path = ?", (path,)).fetchone():
+                    continue  # Another cluster (or an earlier start) already imported this file.
+                legacy = read_volumes_file(path)  # Volumes saved by older versions.
+                if legacy is None:
+                    continue
+                # Import every guild, not just this cluster's: the database is shared, and the file is only imported once.
+                self._db.executemany("INSERT OR IGNORE INTO guild_settings (guild_id, data) VALUES (?, ?)", [(guild_id, json.dumps({"volume": value})) for guild_id, value in legacy.items() if isinstance(value, int)])
+                self._db.execute("INSERT OR IGNORE INTO legacy_imports (path) VALUES (?)", (path,))  # Never import it again.
+            self._db.commit()  # Persist the schema and any imported rows.
+        return self._db
+
+    def load(self, guild_id: str) -> dict:
+        with self._lock:
+            row = self._connection().execute("SELECT data FROM guild_settings WHERE guild_id = ?", (guild_id,)).fetchone()  # Read just this guild's row.
+        return json.loads(row[0]) if row else {}  # Return the stored settings, or nothing.
+
+    def write(self, rows: dict):
+        with self._lock:
+            db = self._connection()  # Get the shared connection.
+            with db:  # Commit every changed guild atomically, or none of them.
+                db.executemany("INSERT OR REPLACE INTO guild_settings (guild_id, data) VALUES (?, ?)", [(guild_id, json.dumps(data)) for guild_id, data in rows.items()])
+
+class JSONSettingsBackend:
+    """Stores every guild in one JSON file, compatible with the old volumes.json format."""
+
+    def __init__(self, path: str):
+        self.path = path  # Location of the JSON file.
+        self.data = None  # Parsed file contents, loaded on first use.
+        self._lock = threading.Lock()  # Serialize access from worker threads.
+
+    def _load_file(self) -> dict:
+        if self.data is None:
+            self.data = {}  # Start empty if there is nothing to read.
+            for guild_id, value in load_legacy_volumes().items():
+                self.data[guild_id] = value if isinstance(value, dict) else {"volume": value}  # Upgrade bare volume values.
+        return self.data
+
+    def load(self, guild_id: str) -> dict:
+        with self._lock:
+            return dict(self._load_file().get(guild_id, {}))  # Return a copy of this guild's settings.
+
+    def write(self, rows: dict):
+        with self._lock:
+            data = self._load_file()  # Make sure the existing guilds are kept.
+            data.update(rows)  # Apply the changed guilds.
+            temp_path = f"{self.path}.tmp"  # Write next to the real file first.
+            with open(temp_path, "w") as f:  # Open the temporary file in write mode.
+                json.dump(data, f)  # Save every guild's settings.
+                f.flush()
+                os.fsync(f.fileno())  # Make sure the data is on disk before swapping files.
+            os.replace(temp_path, self.path)  # Atomically replace the old file.
+
+class GuildSettingsStore:
+    """
+    In-memory cache of per-guild settings in front of a storage backend.
+    Changes are collected and written in the background, at most once per flush interval.
+    """
+
+    def __init__(self, backend, flush_interval: float):
+        self.backend = backend  # Where settings are persisted.
+        self.flush_interval = flush_interval  # Seconds to batch changes before writing.
+        self.cache = {}  # Maps guild ID -> settings dict.
+        self.dirty = set()  # Guild IDs with unsaved changes.
+        self.flush_task = None  # Pending background flush, if any.
+
+    async def get(self, guild_id) -> dict:
+        """Return the guild's settings, loading them from the backend on first use."""
+        guild_id = str(guild_id)  # Settings are keyed by the guild ID as a string.
+        if guild_id not in self.cache:
+            stored = await asyncio.to_thread(self.backend.load, guild_id)  # Read the row off the event loop.
+            self.cache.setdefault(guild_id, {**DEFAULT_SETTINGS, **stored})  # Fill in defaults for missing settings.
+        return self.cache[guild_id]
+
+    async def update(self, guild_id, **changes):
+        """Change some of the guild's settings and schedule a background write."""
+        settings = await self.get(guild_id)  # Make sure the guild is loaded.
+        settings.update(changes)  # Apply the changes in memory right away.
+        self.dirty.add(str(guild_id))  # Mark the guild for the next flush.
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_later())  # Debounce writes.
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)  # Let more changes pile up.
+        await self.flush()  # Write them all at once.
+
+    async def flush(self):
+        """Write every guild with unsaved changes to the backend."""
+        if not self.dirty:
+            return  # Nothing to write.
+        rows = {guild_id: dict(self.cache[guild_id]) for guild_id in self.dirty}  # Snapshot the changed guilds.
+        self.dirty.clear()  # Changes made during the write go into the next flush.
+        try:
+            await asyncio.to_thread(self.backend.write, rows)  # Write them off the event loop.
+        except Exception as e:
+            self.dirty.update(rows)  # Try again on the next flush.
+            print(f"Failed to save guild settings: {e}")  # Log the failure.
+
+    async def close(self):
+        """Cancel the pending flush and write everything that is left."""
+        if self.flush_task is not None and not self.flush_task.done():
+            self.flush_task.cancel()  # The final flush below covers it.
+        await self.flush()  # Persist any remaining changes.
+
+if SETTINGS_BACKEND == "json":
+    guild_settings = GuildSettingsStore(JSONSettingsBackend(volumes_file), SETTINGS_FLUSH_INTERVAL)  # Keep using the JSON file.
+else:
+    guild_settings = GuildSettingsStore(SQLiteSettingsBackend(SETTINGS_DB), SETTINGS_FLUSH_INTERVAL)  # Store settings in SQLite.
+
+##############################
+# Metrics
+##############################
+class Counter:
+    """A Prometheus-style counter with optional labels."""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name  # Metric name.
+        self.help_text = help_text  # Description shown in the exposition output.
+        self.values = {}  # Maps sorted label tuple -> count.
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))  # Normalize the label set.
+        self.values[key] = self.values.get(key, 0) + amount  # Add to the series.
+
+    def total(self) -> float:
+        return sum(self.values.values())  # Sum across every label set.
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(key)} {value}")  # One line per series.
+        return lines
+
+class Histogram:
+    """A Prometheus-style histogram with optional labels."""
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Upper bounds in seconds.
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = default_buckets):
+        self.name = name  # Metric name.
+        self.help_text = help_text  # Description shown in the exposition output.
+        self.buckets = buckets  # Sorted bucket upper bounds.
+        self.series = {}  # Maps sorted label tuple -> [bucket counts..., sum, count].
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))  # Normalize the label set.
+        series = self.series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])  # Create the series on first use.
+        index = bisect.bisect_left(self.buckets, value)  # Smallest bucket the value fits in.
+        if index < len(self.buckets):
+            series[index] += 1  # Values beyond the last bucket only count towards +Inf.
+        series[-2] += value  # Track the running sum.
+        series[-1] += 1  # Track the number of observations.
+
+    def summary(self, **labels) -> tuple:
+        """Return (count, mean, approximate p50, approximate p99) for one label set."""
+        series = self.series.get(tuple(sorted(labels.items())))  # Find the series.
+        if not series or not series[-1]:
+            return 0, 0.0, 0.0, 0.0
+        return series[-1], series[-2] / series[-1], self._quantile(series, 0.5), self._quantile(series, 0.99)
+
+    def _quantile(self, series: list, q: float) -> float:
+        target = q * series[-1]  # Observation rank we're looking for.
+        seen = 0
+        for bound, count in zip(self.buckets, series):
+            seen += count
+            if seen >= target:
+                return bound  # The quantile falls inside this bucket.
+        return float("inf")  # Beyond the largest bucket.
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count  # Buckets are cumulative in the exposition format.
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {series[-2]}")
+            lines.append(f"{self.name}_count{format_labels(key)} {series[-1]}")
+        return lines
+
+def format_bound(seconds: float) -> str:
+    """Format an approximate quantile (a bucket upper bound) in milliseconds."""
+    return f"≤{seconds * 1000:.0f}ms" if seconds != float("inf") else "beyond the largest bucket"
+
+def format_labels(key: tuple) -> str:
+    if not key:
+        return ""  # Unlabelled series.
+    return "{" + ",".join(f'{name}="{value}"' for name, value in key) + "}"  # Prometheus label syntax.
+
+command_latency = Histogram("musicbot_command_seconds", "Time taken to run a command.")
+command_errors = Counter("musicbot_command_errors_total", "Commands that raised an error.")
+search_latency = Histogram("musicbot_lavalink_search_seconds", "Lavalink track search latency.")
+search_failures = Counter("musicbot_lavalink_search_failures_total", "Lavalink track searches that raised an error.")
+spotify_latency = Histogram("musicbot_spotify_request_seconds", "Spotify API request latency.")
+spotify_rate_limits = Counter("musicbot_spotify_rate_limited_total", "Spotify API responses with status 429.")
+loop_lag = Histogram("musicbot_event_loop_lag_seconds", "How late the event loop woke up a sleeping task.", (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+last_loop_lag = 0.0  # Most recent event loop lag measurement, in seconds.
+metrics_runner = None  # aiohttp runner serving the metrics endpoint.
+loop_lag_task = None  # Background task measuring event loop lag.
+startup_phases = {}  # Maps startup phase -> seconds after startup_started it completed.
+
+def mark_startup(phase: str):
+    """Record and log when a startup phase completed; later repeats (e.g. reconnects) are ignored."""
+    if phase in startup_phases:
+        return  # Only the first completion counts towards startup time.
+    startup_phases[phase] = time.perf_counter() - startup_started  # Seconds since startup began.
+    print(f"Startup: {phase} after {startup_phases[phase]:.2f}s")  # Log the phase as it completes.
 
-def save_volumes():
-    with open(volumes_file, "w") as f:  # Open the volumes file in write mode.
-        json.dump(volume_settings, f)  # Save the current volume settings to the file in JSON format.
+async def measure_loop_lag(interval: float = 1.0):
+    """Measure how late asyncio.sleep wakes up, which shows how busy the event loop is."""
+    global last_loop_lag
+    while True:
+        started = time.perf_counter()  # Time before sleeping.
+        await asyncio.sleep(interval)  # Ask to be woken up after `interval`.
+        last_loop_lag = max(time.perf_counter() - started - interval, 0.0)  # Anything beyond the interval is lag.
+        loop_lag.observe(last_loop_lag)
 
-volume_settings = load_volumes()  # Load the volume settings from file at startup.
+def render_metrics() -> str:
+    """Render every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in (command_latency, command_errors, search_latency, search_failures, spotify_latency, spotify_rate_limits, loop_lag):
+        lines.extend(metric.render())  # Counters and histograms collected so far.
+    lines += ["# HELP musicbot_event_loop_lag_last_seconds Most recent event loop lag.", "# TYPE musicbot_event_loop_lag_last_seconds gauge", f"musicbot_event_loop_lag_last_seconds {last_loop_lag}"]
+    lines += ["# HELP musicbot_queue_depth Tracks waiting in each guild's queue.", "# TYPE musicbot_queue_depth gauge"]
+    players_per_node = {identifier: 0 for identifier in wavelink.Pool.nodes}  # Start every node at zero.
+    for player in bot.voice_clients:
+        if isinstance(player, wavelink.Player) and player.guild is not None:
+            lines.append(f'musicbot_queue_depth{{guild="{player.guild.id}"}} {len(player.queue)}')  # Queue depth per guild.
+            players_per_node[player.node.identifier] = players_per_node.get(player.node.identifier, 0) + 1  # Count players per node.
+    lines += ["# HELP musicbot_node_players Players hosted on each Lavalink node.", "# TYPE musicbot_node_players gauge"]
+    lines += [f'musicbot_node_players{{node="{identifier}"}} {count}' for identifier, count in players_per_node.items()]
+    lines += ["# HELP musicbot_track_cache_lookups_total Track cache lookups by result.", "# TYPE musicbot_track_cache_lookups_total counter"]
+    lines += [f'musicbot_track_cache_lookups_total{{result="memory_hit"}} {track_cache.memory_hits}', f'musicbot_track_cache_lookups_total{{result="disk_hit"}} {track_cache.disk_hits}', f'musicbot_track_cache_lookups_total{{result="miss"}} {track_cache.misses}']
+    lines += ["# HELP musicbot_track_cache_hit_ratio Share of track cache lookups answered from cache.", "# TYPE musicbot_track_cache_hit_ratio gauge", f"musicbot_track_cache_hit_ratio {track_cache.hit_ratio()}"]
+    lines += ["# HELP musicbot_startup_phase_seconds Seconds after startup each startup phase completed.", "# TYPE musicbot_startup_phase_seconds gauge"]
+    lines += [f'musicbot_startup_phase_seconds{{phase="{phase}"}} {seconds}' for phase, seconds in startup_phases.items()]
+    return "\n".join(lines) + "\n"
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=render_metrics(), content_type="text/plain")  # Serve the exposition format.
+
+async def start_metrics():
+    """Start the loop lag probe and the local metrics HTTP endpoint."""
+    global metrics_runner, loop_lag_task
+    if loop_lag_task is None:
+        loop_lag_task = asyncio.create_task(measure_loop_lag())  # Start measuring event loop lag.
+    if not METRICS_PORT or metrics_runner is not None:
+        return  # The endpoint is disabled or already running.
+    app = web.Application()  # Minimal web app for the endpoint.
+    app.router.add_get("/metrics", metrics_handler)  # Prometheus scrapes this path.
+    metrics_runner = web.AppRunner(app)  # Runner that owns the server.
+    await metrics_runner.setup()
+    port = METRICS_PORT + int(CLUSTER_ID or 0)  # Give every cluster its own port.
+    await web.TCPSite(metrics_runner, METRICS_HOST, port).start()  # Listen for scrapes.
+    print(f"Serving metrics on http://{METRICS_HOST}:{port}/metrics")  # Log where to scrape.
+
+async def start_command_timer(ctx: commands.Context):
+    ctx.metrics_started = time.perf_counter()  # Remember when the command started.
+
+async def stop_command_timer(ctx: commands.Context):
+    if ctx.command_failed:
+        command_errors.inc(command=ctx.command.qualified_name)  # Count failed commands.
+    started = getattr(ctx, "metrics_started", None)  # Missing if the command never got to run.
+    if started is not None:
+        command_latency.observe(time.perf_counter() - started, command=ctx.command.qualified_name)  # Record how long it took.
+
+##############################
+# Track resolution cache
+##############################
+class TrackCache:
+    """
+    Two-tier cache mapping Spotify track IDs and normalized search strings to Lavalink track data.
+    An in-process LRU sits in front of a SQLite table so resolutions survive restarts.
+    """
+    prune_interval = 100  # Disk writes between sweeps for expired and least recently used rows.
+    touch_interval = 100  # Memory hits between batched recency updates on disk.
+
+    def __init__(self, path: str, ttl: int, memory_size: int, disk_size: int):
+        self.path = path  # Location of the SQLite database.
+        self.ttl = ttl  # Lifetime of an entry in seconds.
+        self.memory_size = memory_size  # Capacity of the in-memory LRU.
+        self.disk_size = disk_size  # Capacity of the SQLite table.
+        self.memory = OrderedDict()  # Maps key -> (expires_at, track data), oldest first.
+        self.memory_hits = 0  # Lookups answered from memory.
+        self.disk_hits = 0  # Lookups answered from SQLite.
+        self.misses = 0  # Lookups that needed a real search.
+        self._db = None  # SQLite connection, opened on first use.
+        self._db_lock = threading.Lock()  # SQLite calls run in worker threads, so serialize them.
+        self._puts = 0  # Disk writes since the last prune.
+        self._touched = {}  # Maps key -> time of memory hits not yet recorded on disk.
+
+    @staticmethod
+    def search_key(query: str) -> str:
+        return "search:" + " ".join(query.lower().split())  # Normalize case and whitespace.
+
+    @staticmethod
+    def spotify_key(spotify_id: str) -> str:
+        return f"spotify:{spotify_id}"  # Key Spotify tracks by their ID.
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)  # Wait for other clusters' writes instead of failing.
+            self._db.execute("PRAGMA journal_mode=WAL")  # Crash-safe writes that don't block readers.
+            self._db.execute("PRAGMA synchronous=NORMAL")  # Commits skip fsync; losing the last few entries in a power cut only costs a search.
+            self._db.execute("CREATE TABLE IF NOT EXISTS track_cache (key TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)")  # Create the table on first run.
+            self._db.execute("CREATE INDEX IF NOT EXISTS track_cache_accessed ON track_cache (accessed)")  # Speed up LRU eviction.
+            self._db.execute("CREATE INDEX IF NOT EXISTS track_cache_expires ON track_cache (expires)")  # Speed up expiry sweeps.
+            self._db.commit()  # Persist the schema.
+        return self._db
+
+    def _disk_get(self, key: str):
+        with self._db_lock:
+            db = self._connection()  # Get the shared connection.
+            row = db.execute("SELECT data, expires FROM track_cache WHERE key = ?", (key,)).fetchone()  # Look the key up.
+            if row is None:
+                return None  # Not cached on disk.
+            if row[1] < time.time():
+                db.execute("DELETE FROM track_cache WHERE key = ?", (key,))  # Drop the expired entry.
+                db.commit()
+                return None
+            db.execute("UPDATE track_cache SET accessed = ? WHERE key = ?", (time.time(), key))  # Refresh its LRU position.
+            db.commit()
+            return row  # Return (data, expires).
+
+    def _disk_touch(self, db: sqlite3.Connection, touched: dict):
+        db.executemany("UPDATE track_cache SET accessed = ? WHERE key = ? AND accessed < ?", [(when, key, when) for key, when in touched.items()])  # Record memory hits so the disk LRU keeps hot keys.
+
+    def _disk_flush(self, touched: dict):
+        with self._db_lock:
+            db = self._connection()  # Get the shared connection.
+            self._disk_touch(db, touched)
+            db.commit()
+
+    def _disk_put(self, keys: list, data: str, expires: float, touched: dict):
+        with self._db_lock:
+            db = self._connection()  # Get the shared connection.
+            self._disk_touch(db, touched)  # Apply pending recency updates before any eviction.
+            now = time.time()  # Use one timestamp for the whole batch.
+            db.executemany("INSERT OR REPLACE INTO track_cache (key, data, expires, accessed) VALUES (?, ?, ?, ?)", [(key, data, expires, now) for key in keys])  # Store every key.
+            self._puts += 1
+            if self._puts >= self.prune_interval:
+                self._puts = 0  # Sweep now and then instead of on every write; the table may briefly exceed disk_size.
+                db.execute("DELETE FROM track_cache WHERE expires < ?", (now,))  # Drop expired entries.
+                cutoff = db.execute("SELECT accessed FROM track_cache ORDER BY accessed DESC LIMIT 1 OFFSET ?", (self.disk_size,)).fetchone()  # Newest entry beyond the size limit.
+                if cutoff is not None:
+                    db.execute("DELETE FROM track_cache WHERE accessed <= ?", cutoff)  # Evict the least recently used entries.
+            db.commit()
+
+    def _disk_purge(self) -> int:
+        with self._db_lock:
+            db = self._connection()  # Get the shared connection.
+            removed = db.execute("DELETE FROM track_cache").rowcount  # Delete every row.
+            db.commit()
+            return removed
+
+    def _disk_count(self) -> int:
+        with self._db_lock:
+            return self._connection().execute("SELECT COUNT(*) FROM track_cache").fetchone()[0]  # Count stored rows.
+
+    def _remember(self, key: str, expires: float, data: str):
+        self.memory[key] = (expires, data)  # Store or refresh the entry.
+        self.memory.move_to_end(key)  # Mark it as most recently used.
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)  # Evict the least recently used entry.
+
+    async def get(self, *keys: str) -> wavelink.Playable:
+        """Return the cached track for the first of `keys` that is present, or None on a miss."""
+        for key in keys:
+            entry = self.memory.get(key)  # Try the in-memory tier first.
+            if entry is not None and entry[0] >= time.time():
+                self.memory.move_to_end(key)  # Mark it as most recently used.
+                self.memory_hits += 1
+                self._touched[key] = time.time()  # Written to disk in batches.
+                if len(self._touched) >= self.touch_interval:
+                    await self._flush_touched()
+                return wavelink.Playable(json.loads(entry[1]))  # Rebuild the track without touching Lavalink.
+            self.memory.pop(key, None)  # Drop the entry if it expired.
+        for key in keys:
+            try:
+                row = await asyncio.to_thread(self._disk_get, key)  # Fall back to the on-disk tier.
+            except sqlite3.Error as e:
+                print(f"Track cache read failed: {e}")  # Treat database errors as misses.
+                row = None
+            if row is not None:
+                self.disk_hits += 1
+                self._remember(key, row[1], row[0])  # Promote the entry into memory.
+                return wavelink.Playable(json.loads(row[0]))  # Rebuild the track without touching Lavalink.
+        self.misses += 1
+        return None
+
+    async def _flush_touched(self):
+        touched, self._touched = self._touched, {}  # Take the batch so new hits start a fresh one.
+        try:
+            await asyncio.to_thread(self._disk_flush, touched)
+        except sqlite3.Error as e:
+            print(f"Track cache recency update failed: {e}")  # Only affects which rows are evicted first.
+
+    async def put(self, keys: list, track: wavelink.Playable):
+        """Store `track` and its extras under every key in `keys`."""
+        data = json.dumps({**track.raw_data, "userData": dict(track.extras)})  # Serialize the full Lavalink track payload; Playable reads extras back from userData.
+        expires = time.time() + self.ttl  # Compute when the entry goes stale.
+        for key in keys:
+            self._remember(key, expires, data)  # Store it in memory.
+        touched, self._touched = self._touched, {}  # Piggyback pending recency updates on the write.
+        try:
+            await asyncio.to_thread(self._disk_put, keys, data, expires, touched)  # Store it on disk.
+        except sqlite3.Error as e:
+            print(f"Track cache write failed: {e}")  # The memory tier still has the entry.
+
+    async def purge(self) -> int:
+        """Remove every cached entry. Returns the number of rows removed from disk."""
+        self.memory.clear()  # Empty the memory tier.
+        self._touched.clear()  # Nothing left to update.
+        return await asyncio.to_thread(self._disk_purge)  # Empty the disk tier.
+
+    def hit_ratio(self) -> float:
+        lookups = self.memory_hits + self.disk_hits + self.misses  # Total number of lookups so far.
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+    async def stats(self) -> dict:
+        """Return entry counts and hit/miss counters."""
+        return {
+            "memory_entries": len(self.memory),
+            "disk_entries": await asyncio.to_thread(self._disk_count),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": self.hit_ratio(),
+        }
+
+track_cache = TrackCache(CACHE_DB, CACHE_TTL, CACHE_MEMORY_SIZE, CACHE_DISK_SIZE)  # Shared cache used by every guild.
 
 # Helper function to create a sleek embed
 def make_embed(title: str, description: str, color=discord.Color.blue()) -> discord.Embed:
@@ -48,111 +553,734 @@ def make_embed(title: str, description: str, color=discord.Color.blue()) -> disc
     embed.set_footer(text="Music Bot")  # Set the footer text for the embed.
     return embed  # Return the constructed embed.
 
+##############################
+# Outbound messages
+##############################
+class RateLimitBucket:
+    """Sliding-window limit of `limit` requests every `per` seconds, like Discord's per-route buckets."""
+
+    def __init__(self, limit: int, per: float):
+        self.limit = limit  # Requests allowed per window.
+        self.per = per  # Window length in seconds.
+        self.times = deque()  # When recent requests were made.
+
+    def delay(self) -> float:
+        """Seconds to wait before the next request fits in the bucket."""
+        now = time.monotonic()
+        while self.times and now - self.times[0] >= self.per:
+            self.times.popleft()  # Forget requests that left the window.
+        return 0.0 if len(self.times) < self.limit else self.times[0] + self.per - now
+
+    def record(self):
+        self.times.append(time.monotonic())  # Count a request against the bucket.
+
+    def empty(self) -> bool:
+        """Whether no request made in the current window is still counted."""
+        self.delay()  # Forget requests that left the window.
+        return not self.times
+
+class ChannelDispatcher:
+    """
+    Outbound queue for one text channel. Embeds posted close together go out as one
+    message of up to 10 embeds, the now playing embed is edited in place while it is
+    still our latest message, and every request waits for room in the channel's
+    rate-limit bucket instead of running into Discord's 429s.
+    """
+    max_embeds = 10  # Discord accepts at most 10 embeds per message.
+
+    def __init__(self, channel):
+        self.channel = channel  # Channel the messages go to.
+        self.pending = deque()  # (embed, view, future) entries waiting to be sent, in order.
+        self.now_playing = None  # Newest now playing embed that has not been shown yet.
+        self.now_playing_message = None  # Message showing the now playing embed.
+        self.now_playing_embeds = []  # Embeds of that message; the now playing embed is last.
+        self.last_message = None  # Last message we sent to the channel.
+        self.send_bucket = RateLimitBucket(5, 5.0)  # Discord allows 5 new messages per 5 seconds per channel.
+        self.edit_bucket = RateLimitBucket(5, 5.0)  # Message edits have a bucket of their own.
+        self.task = None  # Task draining the queue, while there is anything to send.
+
+    def post(self, embed: discord.Embed, view: discord.ui.View = None) -> asyncio.Future:
+        """Queue an embed. Returns a future for the message that carried it (None if sending failed)."""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((embed, view, future))
+        self._wake()
+        return future
+
+    def set_now_playing(self, embed: discord.Embed):
+        """Show `embed` as the channel's now playing message. Only the newest update is sent."""
+        self.now_playing = embed
+        self._wake()
+
+    def idle(self) -> bool:
+        """Whether the dispatcher holds no work or state worth keeping, so it can be dropped."""
+        return (self.task is None or self.task.done()) and not self.pending and self.now_playing is None and self.now_playing_message is None and self.send_bucket.empty() and self.edit_bucket.empty()
+
+    def _wake(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())  # Start draining the queue.
+
+    def _take_batch(self) -> list:
+        if self.pending[0][1] is not None:
+            return [self.pending.popleft()]  # Messages with components are sent on their own.
+        batch = []
+        while self.pending and self.pending[0][1] is None and len(batch) < self.max_embeds:
+            batch.append(self.pending.popleft())  # Merge consecutive plain embeds.
+        return batch
+
+    async def _run(self):
+        while self.pending or self.now_playing is not None:
+            await asyncio.sleep(DISPATCH_DELAY)  # Let a burst of embeds gather.
+            editing = not self.pending and self.now_playing_message is not None and self.now_playing_message is self.last_message  # Update in place when nothing was sent since.
+            delay = (self.edit_bucket if editing else self.send_bucket).delay()
+            if delay > 0:
+                await asyncio.sleep(delay)  # Wait for the bucket; more embeds can be merged meanwhile.
+                continue
+            if editing:
+                await self._edit_now_playing()
+            else:
+                await self._send_batch()
+
+    async def _send_batch(self):
+        batch = self._take_batch() if self.pending else []  # Entries going out in this message.
+        embeds = [embed for embed, _, _ in batch]
+        view = batch[0][1] if batch else None
+        now_playing = self.now_playing if view is None and len(embeds) < self.max_embeds else None  # Ride along when there is room.
+        if now_playing is not None:
+            embeds.append(now_playing)
+            self.now_playing = None  # Newer updates arriving during the send are kept.
+        self.send_bucket.record()
+        try:
+            message = await self.channel.send(embeds=embeds, view=view)  # One API call for the whole burst.
+        except discord.HTTPException as e:
+            print(f"Failed to send {len(embeds)} embed(s) to channel {self.channel.id}: {e}")  # Nobody waits on most sends, so log it.
+            message = None
+        except Exception as e:
+            print(f"Failed to send {len(embeds)} embed(s) to channel {self.channel.id}: {e!r}")  # Unexpected; keep the queue running.
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)  # Wake up anyone waiting on the message.
+            return
+        else:
+            self.last_message = message
+            if now_playing is not None:
+                self.now_playing_message, self.now_playing_embeds = message, embeds  # Later tracks edit this message.
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(message)
+
+    async def _edit_now_playing(self):
+        embeds = self.now_playing_embeds[:-1] + [self.now_playing]  # Keep anything that was sent alongside it.
+        self.now_playing = None  # Newer updates arriving during the edit are kept.
+        self.edit_bucket.record()
+        try:
+            await self.now_playing_message.edit(embeds=embeds)  # Replace the old track in place.
+        except discord.NotFound:
+            self.now_playing_message = None  # The message was deleted; post a new one next time.
+            if self.now_playing is None:
+                self.now_playing = embeds[-1]
+        except Exception as e:
+            print(f"Failed to update the now playing message in channel {self.channel.id}: {e!r}")  # Keep the queue running.
+        else:
+            self.now_playing_embeds = embeds
+
+channel_dispatchers = {}  # Maps channel ID -> ChannelDispatcher.
+
+def prune_dispatchers():
+    """Drop dispatchers of channels that have gone quiet."""
+    for channel_id, dispatcher in list(channel_dispatchers.items()):
+        if dispatcher.idle():
+            del channel_dispatchers[channel_id]
+
+def release_dispatchers(guild_id: int, forget: bool = False):
+    """
+    Stop keeping the guild's now playing messages around once its player is gone, so its dispatchers
+    can be pruned. `forget` drops them right away, e.g. when the bot was removed from the guild.
+    """
+    for channel_id, dispatcher in list(channel_dispatchers.items()):
+        if getattr(getattr(dispatcher.channel, "guild", None), "id", None) != guild_id:
+            continue
+        dispatcher.now_playing_message, dispatcher.now_playing_embeds = None, []  # The next session posts a fresh message.
+        if forget:
+            if dispatcher.task and not dispatcher.task.done():
+                dispatcher.task.cancel()  # Nothing can be sent there any more.
+            for _, _, future in dispatcher.pending:
+                if not future.done():
+                    future.set_result(None)  # Same as a failed send.
+            del channel_dispatchers[channel_id]
+    prune_dispatchers()
+
+def channel_dispatcher(channel) -> ChannelDispatcher:
+    dispatcher = channel_dispatchers.get(channel.id)
+    if dispatcher is None:
+        prune_dispatchers()  # Sweep quiet channels before adding another.
+        dispatcher = channel_dispatchers[channel.id] = ChannelDispatcher(channel)  # First message to this channel.
+    dispatcher.channel = channel  # Keep the freshest channel object.
+    return dispatcher
+
+def send_embed(channel, embed: discord.Embed, view: discord.ui.View = None) -> asyncio.Future:
+    """Queue an embed for `channel` through its dispatcher. Await the result only when the message is needed."""
+    return channel_dispatcher(channel).post(embed, view)
+
+def show_now_playing(channel, track: wavelink.Playable):
+    """Show `track` in the channel's now playing message."""
+    channel_dispatcher(channel).set_now_playing(make_embed("Now Playing", f"🎶 **{track.title}** by **{track.author}**"))
+
+##############################
+# Queue entries and player
+##############################
+@dataclass(eq=False)
+class DeferredTrack:
+    """
+    Lightweight queue entry for a Spotify track that has not been searched on Lavalink yet.
+    It is swapped for a wavelink.Playable once it gets close to the head of the queue.
+    """
+    title: str  # Track name as reported by Spotify.
+    author: str  # Primary artist name as reported by Spotify.
+    spotify_id: str = None  # Spotify track ID, if known.
+
+    @property
+    def query(self) -> str:
+        return f"ytsearch:{self.title} {self.author}"  # Build the YouTube search query for this entry.
+
+class MusicQueue(wavelink.Queue):
+    """A wavelink Queue that can hold both resolved tracks and DeferredTrack placeholders."""
+
+    @staticmethod
+    def _check_compatibility(item: object) -> bool:
+        if not isinstance(item, (wavelink.Playable, DeferredTrack)):  # Only accept tracks and placeholders.
+            raise TypeError("This queue is restricted to Playable and DeferredTrack objects.")
+        return True
+
+    def _find(self, entry) -> int:
+        for index, item in enumerate(self._items):  # Look the entry up by identity, not equality.
+            if item is entry:
+                return index
+        return -1  # The entry is no longer in the queue.
+
+    def replace(self, entry: DeferredTrack, track: wavelink.Playable) -> None:
+        index = self._find(entry)  # Find where the placeholder currently sits.
+        if index != -1:
+            self[index] = track  # Swap the placeholder for the resolved track in place.
+
+    def discard(self, entry: DeferredTrack) -> None:
+        index = self._find(entry)  # Find where the placeholder currently sits.
+        if index != -1:
+            del self[index]  # Drop the placeholder from the queue.
+
+class MusicPlayer(wavelink.Player):
+    """
+    A wavelink Player using MusicQueue so that deferred entries can be queued.
+    New players are placed on the least-loaded playback node, preferring the voice channel's region.
+    """
+
+    def __init__(self, client: discord.Client = discord.utils.MISSING, channel=discord.utils.MISSING, *, nodes: list = None):
+        if nodes is None:
+            nodes = [select_node("playback", region=getattr(channel, "rtc_region", None))]  # Pick the best node for this channel.
+        super().__init__(client, channel, nodes=nodes)
+        self.queue: MusicQueue = MusicQueue()  # Replace the default queue with one that accepts placeholders.
+        self.resolve_lock = asyncio.Lock()  # Serialize prefetch passes for this player.
+        self.play_lock = asyncio.Lock()  # Serialize taking the next entry off the queue and starting it.
+        self.prefetch_task = None  # Reference to the running prefetch task, if any.
+        self.preload_task = None  # Task getting the next track ready before the current one ends.
+        self.start_position = 0  # Where the next track starts in milliseconds; set when restoring a session.
+        self.track_clock = (0.0, 0)  # (monotonic time, position in ms) when the current track last started, paused or resumed.
+        self.empty_task = None  # Task that leaves the voice channel once nobody is listening.
+        self.failed_tracks = set()  # Identifiers of tracks Lavalink could not load for this guild.
+
+    async def disconnect(self, **kwargs):
+        for task in (self.prefetch_task, self.preload_task, self.empty_task):
+            if task and not task.done() and task is not asyncio.current_task():
+                task.cancel()  # Background work for this player is no longer needed.
+        if self.guild is not None:
+            release_dispatchers(self.guild.id)  # The now playing message belongs to this session.
+        await super().disconnect(**kwargs)
+
+##############################
+# Session snapshots
+##############################
+class SessionStore:
+    """Stores one snapshot row per guild, plus Lavalink session IDs, so playback can resume after a restart."""
+
+    def __init__(self, path: str):
+        self.path = path  # Location of the SQLite database.
+        self._db = None  # Connection, opened on first use from a worker thread.
+        self._lock = threading.Lock()  # Serialize access from worker threads.
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)  # Wait for other clusters' writes instead of failing.
+            self._db.execute("PRAGMA journal_mode=WAL")  # Crash-safe writes that don't block readers.
+            self._db.execute("CREATE TABLE IF NOT EXISTS sessions (guild_id TEXT PRIMARY KEY, state TEXT NOT NULL, queue TEXT NOT NULL)")  # Player state and queue.
+            self._db.execute("CREATE TABLE IF NOT EXISTS node_sessions (name TEXT PRIMARY KEY, session_id TEXT NOT NULL)")  # Lavalink session IDs.
+            self._db.commit()  # Persist the schema.
+        return self._db
+
+    def load_all(self) -> dict:
+        with self._lock:
+            rows = self._connection().execute("SELECT guild_id, state, queue FROM sessions").fetchall()  # Read every snapshot.
+        return {guild_id: (json.loads(state), json.loads(queue)) for guild_id, state, queue in rows}
+
+    def save(self, states: dict, queues: dict, removed: list):
+        with self._lock:
+            db = self._connection()  # Get the shared connection.
+            with db:  # Apply the whole snapshot atomically.
+                db.executemany("INSERT INTO sessions (guild_id, state, queue) VALUES (?, ?, '[]') ON CONFLICT(guild_id) DO UPDATE SET state = excluded.state", list(states.items()))  # The small state row changes every time.
+                db.executemany("UPDATE sessions SET queue = ? WHERE guild_id = ?", [(queue, guild_id) for guild_id, queue in queues.items()])  # Queues are only rewritten when they changed.
+                db.executemany("DELETE FROM sessions WHERE guild_id = ?", [(guild_id,) for guild_id in removed])  # Forget players that are gone.
+
+    def delete(self, guild_ids: list):
+        with self._lock:
+            db = self._connection()  # Get the shared connection.
+            with db:
+                db.executemany("DELETE FROM sessions WHERE guild_id = ?", [(guild_id,) for guild_id in guild_ids])  # Forget sessions that can't come back.
+
+    def load_node_sessions(self) -> dict:
+        with self._lock:
+            return dict(self._connection().execute("SELECT name, session_id FROM node_sessions").fetchall())  # Map node name -> session ID.
+
+    def save_node_session(self, name: str, session_id: str):
+        with self._lock:
+            db = self._connection()  # Get the shared connection.
+            with db:
+                db.execute("INSERT OR REPLACE INTO node_sessions (name, session_id) VALUES (?, ?)", (name, session_id))  # Remember the latest session.
+
+session_store = SessionStore(SESSION_DB)  # Shared snapshot store.
+session_queue_fingerprints = {}  # Maps guild ID -> fingerprint of the last saved queue.
+snapshot_task = None  # Background task taking periodic snapshots.
+sessions_restored = False  # Set once saved sessions have been restored after startup.
+
+def node_session_name(identifier: str) -> str:
+    return f"{CLUSTER_ID or 0}:{identifier}"  # Every cluster has its own Lavalink sessions.
+
+def serialize_entry(entry) -> dict:
+    """Convert a queue entry to JSON-friendly data without losing its resolution."""
+    if isinstance(entry, DeferredTrack):
+        return {"deferred": {"title": entry.title, "author": entry.author, "spotify_id": entry.spotify_id}}  # Still unresolved.
+    return {"track": entry.raw_data}  # The full Lavalink payload, so no search is needed on restore.
+
+def deserialize_entry(data: dict):
+    """Rebuild a queue entry saved by serialize_entry."""
+    if "deferred" in data:
+        return DeferredTrack(**data["deferred"])  # Recreate the placeholder.
+    return wavelink.Playable(data["track"])  # Recreate the track without asking Lavalink.
+
+async def snapshot_sessions():
+    """Save the state of every player; queues are only rewritten when they changed."""
+    if bot.is_closed():
+        return  # Players are being torn down; keep the last snapshot for the next start.
+    states = {}  # Maps guild ID -> serialized player state.
+    queues = {}  # Maps guild ID -> serialized queue, for changed queues only.
+    active = set()  # Guilds that currently have a player.
+    for player in bot.voice_clients:
+        if not isinstance(player, MusicPlayer) or player.guild is None or player.channel is None:
+            continue  # Only snapshot fully connected music players.
+        guild_id = str(player.guild.id)  # Sessions are keyed by the guild ID as a string.
+        active.add(guild_id)
+        states[guild_id] = json.dumps({
+            "voice_channel_id": player.channel.id,
+            "text_channel_id": getattr(getattr(player, "text_channel", None), "id", None),
+            "node": player.node.identifier,
+            "current": player.current.raw_data if player.current else None,
+            "position": player.position,
+            "paused": player.paused,
+            "volume": player.volume,
+            "mode": player.queue.mode.name,
+        })  # Small state that changes on every snapshot.
+        fingerprint = (player.queue.mode, player.current.identifier if player.current else None, tuple(getattr(entry, "identifier", None) or entry.query for entry in player.queue))  # Content, not object ids, which CPython reuses after garbage collection.
+        if session_queue_fingerprints.get(guild_id) != fingerprint:
+            queues[guild_id] = json.dumps([serialize_entry(entry) for entry in player.queue])  # Serialize only changed queues.
+            session_queue_fingerprints[guild_id] = fingerprint  # Remember what was saved.
+    removed = [guild_id for guild_id in session_queue_fingerprints if guild_id not in active]  # Players that went away.
+    for guild_id in removed:
+        del session_queue_fingerprints[guild_id]  # Stop tracking them.
+    await asyncio.to_thread(session_store.save, states, queues, removed)  # Write off the event loop.
+
+async def snapshot_loop():
+    """Take a snapshot every SNAPSHOT_INTERVAL seconds."""
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)  # Wait between snapshots.
+        try:
+            await snapshot_sessions()  # Save every player's state.
+        except Exception as e:
+            print(f"Failed to snapshot sessions: {e}")  # Keep trying on the next interval.
+
+async def restore_session(guild: discord.Guild, state: dict, queue: list) -> bool:
+    """Rejoin the saved voice channel and continue playback where it stopped, without re-resolving tracks. Returns whether it did."""
+    channel = guild.get_channel(state["voice_channel_id"])  # The voice channel the bot was in.
+    if channel is None or guild.voice_client is not None:
+        return False  # The channel is gone, or someone already started a new session.
+    node = wavelink.Pool.nodes.get(state["node"])  # Prefer the node that may still hold the player.
+    if node is not None and node.status is wavelink.NodeStatus.CONNECTED:
+        player = await channel.connect(cls=functools.partial(MusicPlayer, nodes=[node]))  # Reattach to the resumed Lavalink player.
+    else:
+        player = await channel.connect(cls=MusicPlayer)  # Place the player on the best available node.
+    player.autoplay = wavelink.AutoPlayMode.disabled  # Disable autoplay mode.
+    player.text_channel = guild.get_channel(state["text_channel_id"]) if state["text_channel_id"] else None  # Restore where announcements go.
+    player.queue.put([deserialize_entry(entry) for entry in queue])  # Restore the queue as it was.
+    player.queue.mode = wavelink.QueueMode[state["mode"]]  # Restore the loop mode.
+    position = state["position"]  # Where playback stopped at the last snapshot.
+    try:
+        info = await player.node.fetch_player_info(guild.id)  # A resumed Lavalink session knows the exact position.
+        if info is not None and info.track is not None and state["current"] and info.track.encoded == state["current"]["encoded"]:
+            position = info.state.position  # Use the live position instead of the snapshot's.
+    except Exception:
+        pass  # Fall back to the snapshot position.
+    if state["current"]:
+        player.start_position = position  # Time the preload from here when the track starts.
+        await player.play(wavelink.Playable(state["current"]), start=position, volume=state["volume"], paused=state["paused"])  # Seek straight to where it stopped.
+        schedule_preload(player, position)  # In case the track start event arrived before the pause state was applied.
+    elif state["volume"] != player.volume:
+        await player.set_volume(state["volume"])  # Restore the volume for the next track.
+    schedule_prefetch(player)  # Resolve upcoming deferred entries.
+    if player.text_channel:
+        send_embed(player.text_channel, make_embed("Session Restored", f"🔄 Picked up where we left off with **{len(player.queue)}** tracks in the queue."))  # Let the channel know.
+    return True
+
+async def restore_sessions():
+    """Restore every saved session for this cluster's guilds, rejoining at most RESUME_RATE channels per second."""
+    global snapshot_task
+    await wait_for_node(None)  # Saved players can only be recreated on a connected node.
+    try:
+        sessions = await asyncio.to_thread(session_store.load_all)  # Read every snapshot.
+    except sqlite3.Error as e:
+        print(f"Failed to load saved sessions: {e}")  # Start fresh.
+        sessions = {}
+    restored = 0  # Number of sessions brought back.
+    stale = []  # This cluster's sessions that could not be brought back.
+    for guild_id, (state, queue) in sessions.items():
+        if not owns_guild(guild_id):
+            continue  # The guild belongs to another cluster.
+        guild = bot.get_guild(int(guild_id))
+        if guild is None:
+            stale.append(guild_id)  # The bot was removed from the guild.
+            continue
+        try:
+            if await restore_session(guild, state, queue):  # Rejoin and resume playback.
+                restored += 1
+                session_queue_fingerprints[guild_id] = None  # Track the row so it is rewritten or removed by the next snapshot.
+            else:
+                stale.append(guild_id)  # The channel is gone or a new session took over.
+        except Exception as e:
+            print(f"Failed to restore session for guild {guild_id}: {e}")  # Skip this guild.
+            stale.append(guild_id)
+        await asyncio.sleep(1 / RESUME_RATE)  # Rejoin voice channels at a controlled rate.
+    print(f"Restored {restored} of {len(sessions)} saved session(s).")  # Log the result.
+    if stale:
+        try:
+            await asyncio.to_thread(session_store.delete, stale)  # Don't retry them on every restart.
+        except sqlite3.Error as e:
+            print(f"Failed to remove stale sessions: {e}")
+    mark_startup("sessions_restored")  # The bot is fully back to where it was.
+    if snapshot_task is None:
+        snapshot_task = asyncio.create_task(snapshot_loop())  # Only start snapshotting once old sessions are back.
+
 ##############################
 # Setup Lavalink Node in setup_hook
 ##############################
+node_configs = {}  # Maps node identifier -> its config entry (regions, roles).
+node_stats = {}  # Maps node identifier -> latest wavelink.StatsResponsePayload.
+search_load = {}  # Maps node identifier -> number of searches currently in flight.
+node_stats_task = None  # Background task polling Lavalink stats.
+
+def load_node_configs() -> list:
+    """
+    Read node definitions from LAVALINK_NODES_FILE, a JSON list of objects with
+    "uri", "password" and optionally "identifier", "regions" (Discord voice regions)
+    and "roles" (any of "playback", "search"). Falls back to a single local node.
+    """
+    try:
+        with open(LAVALINK_NODES_FILE, "r") as f:  # Try opening the nodes file in read mode.
+            configs = json.load(f)  # Load the list of node definitions.
+    except FileNotFoundError:
+        configs = [{"uri": os.getenv("LAVALINK_URI", "http://localhost:2333"), "password": os.getenv("LAVALINK_PASSWORD", "youshallnotpass")}]  # Default to one local node.
+    for index, config in enumerate(configs):
+        config.setdefault("identifier", f"node-{index}")  # Give every node a stable name.
+        config.setdefault("regions", [])  # No region preference by default.
+        config.setdefault("roles", ["playback", "search"])  # Nodes serve both roles by default.
+    return configs
+
+def node_penalty(node: wavelink.Node) -> float:
+    """Load score for a node based on its Lavalink stats, in the spirit of Lavalink's own client penalties."""
+    stats = node_stats.get(node.identifier)  # Latest stats for this node, if any.
+    if stats is None:
+        return float(len(node.players))  # Without stats, fall back to our own player count.
+    penalty = stats.playing + 1.05 ** (100 * stats.cpu.system_load) * 10 - 10  # Players plus CPU pressure.
+    if stats.frames is not None:
+        penalty += 1.03 ** (500 * stats.frames.deficit / 3000) * 600 - 600  # Frames that were never sent.
+        penalty += (1.03 ** (500 * stats.frames.nulled / 3000) * 300 - 300) * 2  # Frames sent as silence.
+    return penalty
+
+def select_node(role: str, region: str = None) -> wavelink.Node:
+    """
+    Return the connected node with the lowest load for `role` ("playback" or "search").
+    Playback prefers nodes serving the voice channel's region; search spreads by in-flight searches.
+    """
+    nodes = [node for node in wavelink.Pool.nodes.values() if node.status is wavelink.NodeStatus.CONNECTED]  # Only healthy nodes.
+    if not nodes:
+        raise wavelink.InvalidNodeException("No Lavalink nodes are currently available.")
+    candidates = [node for node in nodes if role in node_configs.get(node.identifier, {}).get("roles", [role])] or nodes  # Fall back to any node if none has the role.
+    if role == "playback" and region:
+        candidates = [node for node in candidates if region in node_configs.get(node.identifier, {}).get("regions", [])] or candidates  # Prefer nodes near the voice server.
+    if role == "search":
+        return min(candidates, key=lambda node: (search_load.get(node.identifier, 0), node_penalty(node)))  # Spread searches by in-flight count.
+    return min(candidates, key=node_penalty)  # Place players on the least-loaded node.
+
+async def poll_node_stats():
+    """Periodically refresh Lavalink stats for every connected node."""
+    while True:
+        for node in list(wavelink.Pool.nodes.values()):
+            if node.status is not wavelink.NodeStatus.CONNECTED:
+                node_stats.pop(node.identifier, None)  # Forget stats from nodes that are down.
+                continue
+            try:
+                node_stats[node.identifier] = await node.fetch_stats()  # Fetch players, CPU and frame stats.
+            except Exception as e:
+                print(f"Failed to fetch stats from Lavalink node {node.identifier}: {e}")  # Keep the previous stats.
+        await asyncio.sleep(NODE_STATS_INTERVAL)  # Wait before polling again.
+
+node_available = asyncio.Event()  # Set whenever a Lavalink node becomes ready.
+node_tasks = []  # Background tasks bringing each configured node online.
+
+def node_connected() -> bool:
+    """Whether at least one Lavalink node is connected."""
+    return any(node.status is wavelink.NodeStatus.CONNECTED for node in wavelink.Pool.nodes.values())
+
+async def wait_for_node(timeout: float = NODE_WAIT_TIMEOUT) -> bool:
+    """Wait up to `timeout` seconds (None waits forever) for a Lavalink node; returns whether one is connected."""
+    deadline = None if timeout is None else time.monotonic() + timeout  # When to give up.
+    while not node_connected():
+        node_available.clear()  # Wait for the next node_ready event.
+        remaining = None if deadline is None else deadline - time.monotonic()  # Time left to wait.
+        if remaining is not None and remaining <= 0:
+            return False
+        try:
+            await asyncio.wait_for(node_available.wait(), remaining)  # Wake up when any node is ready.
+        except asyncio.TimeoutError:
+            return False
+    return True
+
+async def connect_node(config: dict, session_id: str = None):
+    """
+    Bring one node online. wavelink keeps retrying unreachable nodes with its own backoff;
+    nodes that refuse the connection (wrong password or port) are retried here with exponential backoff.
+    """
+    delay = 1.0  # Wait before the next attempt, doubled every time.
+    while True:
+        node = wavelink.Node(identifier=config["identifier"], uri=config["uri"], password=config["password"], inactive_player_timeout=IDLE_TIMEOUT or None)  # Create a Lavalink node; idle players fire on_wavelink_inactive_player.
+        node._session_id = session_id  # Ask Lavalink to resume the previous session; wavelink has no public setter for this.
+        await wavelink.Pool.connect(nodes=[node], client=bot, cache_capacity=100)  # Returns once connected, or after Lavalink refuses us.
+        if node.identifier in wavelink.Pool.nodes:
+            return  # The node joined the pool.
+        print(f"Lavalink node {node.identifier} refused the connection; retrying in {delay:.0f}s.")  # Log the failed attempt.
+        await asyncio.sleep(delay)  # Back off before trying again.
+        delay = min(delay * 2, NODE_RETRY_MAX)
+
 async def connect_nodes():
-    """Connect to Lavalink node(s) using Wavelink Pool."""
-    node = wavelink.Node(uri="http://localhost:2333", password="youshallnotpass")  # Create a Lavalink node with specified URI and password.
-    await wavelink.Pool.connect(nodes=[node], client=bot, cache_capacity=100)  # Connect to the Lavalink node(s) using the Wavelink pool.
-    print("Connected to Lavalink.")  # Print a confirmation message in the console.
+    """Connect to every Lavalink node concurrently in the background, so login doesn't wait for Lavalink."""
+    global node_stats_task
+    try:
+        saved_sessions = await asyncio.to_thread(session_store.load_node_sessions)  # Lavalink sessions from before the restart.
+    except sqlite3.Error:
+        saved_sessions = {}  # Connect with fresh sessions.
+    for config in load_node_configs():
+        node_configs[config["identifier"]] = config  # Remember the node's regions and roles.
+        node_tasks.append(asyncio.create_task(connect_node(config, saved_sessions.get(node_session_name(config["identifier"])))))  # Nodes come up independently.
+    if node_stats_task is None:
+        node_stats_task = asyncio.create_task(poll_node_stats())  # Start tracking node load.
 
-@bot.event
 async def setup_hook():
-    await connect_nodes()  # Connect to Lavalink nodes when the bot's setup hook is triggered.
+    mark_startup("logged_in")  # discord.py calls this right after logging in.
+    await asyncio.gather(start_metrics(), connect_nodes())  # Start metrics while node connections are launched.
+    mark_startup("setup_hook")  # The gateway connects from here on, while nodes keep connecting.
+
+async def on_wavelink_node_disconnected(payload: wavelink.NodeDisconnectedEventPayload):
+    """Move players off a node that dropped, keeping their queue and position."""
+    node_stats.pop(payload.node.identifier, None)  # The node's stats are no longer meaningful.
+    for player in list(bot.voice_clients):
+        if not isinstance(player, wavelink.Player) or player.node.identifier != payload.node.identifier:
+            continue  # Only migrate players that lived on the dropped node.
+        if getattr(player, "migrating", False):
+            continue  # A migration for this player is already in progress.
+        player.migrating = True  # Guard against the event firing twice for the same drop.
+        try:
+            new_node = select_node("playback", region=getattr(player.channel, "rtc_region", None))  # Pick a healthy node.
+            if new_node.identifier == payload.node.identifier:
+                continue  # The node already came back; its session resume keeps the player alive.
+            await player.switch_node(new_node)  # Replay the current track on the new node at the same position.
+            print(f"Moved player for guild {player.guild.id} from {payload.node.identifier} to {new_node.identifier}.")  # Log the migration.
+        except wavelink.InvalidNodeException:
+            print(f"No healthy Lavalink node available for guild {player.guild.id}; waiting for {payload.node.identifier} to resume.")  # Lavalink session resuming may still recover it.
+        except Exception as e:
+            print(f"Failed to move player for guild {player.guild.id}: {e}")  # Log the failure.
+            await player.disconnect()  # Avoid leaving a stale player behind.
+        finally:
+            player.migrating = False  # Allow future migrations.
+
+async def on_wavelink_node_ready(payload: wavelink.NodeReadyEventPayload):
+    node_available.set()  # Wake up commands waiting for a node.
+    mark_startup(f"node_ready:{payload.node.identifier}")  # Time how long each node took to come up.
+    if payload.resumed:
+        print(f"Resumed Lavalink session on {payload.node.identifier}.")  # The node kept our players across the restart.
+    await asyncio.to_thread(session_store.save_node_session, node_session_name(payload.node.identifier), payload.session_id)  # Remember the session for the next restart.
 
-@bot.event
 async def on_ready():
-    print(f"Logged in as {bot.user} - Ready to play music!")  # Print a message when the bot is ready and logged in.
+    global sessions_restored
+    shards = f" (cluster {CLUSTER_ID}, shards {bot.shard_ids})" if CLUSTER_ID else ""  # Describe which shards this process runs.
+    print(f"Logged in as {bot.user}{shards} - Ready to play music!")  # Print a message when the bot is ready and logged in.
+    mark_startup("gateway_ready")  # Commands are accepted from here on.
+    if not sessions_restored:
+        sessions_restored = True  # on_ready fires again after reconnects; only restore once.
+        await restore_sessions()  # Bring back the players that were running before the restart.
 
 ##############################
 # Event: When a track ends, play the next track from the queue.
 ##############################
-@bot.event
 async def on_wavelink_track_end(payload: wavelink.TrackEndEventPayload):
     player = payload.player  # Get the player instance from the payload.
-    # If the queue isn't empty, play the next track
-    if not player.queue.is_empty:
-        next_track = player.queue.get()  # Retrieve the next track from the queue.
-        await player.play(next_track)  # Play the next track.
+    if player is None or payload.reason == "replaced":
+        return  # Nothing to do if the player is gone or a new track already replaced this one.
+    next_track = None  # Track that starts playing next.
+    if payload.reason == "loadFailed" and isinstance(player, MusicPlayer):
+        next_track = await fallback_track(player, payload.track)  # Try another search result for the same song.
+        if next_track:
+            async with player.play_lock:  # Don't replace a track a play command started in the meantime.
+                if player.playing:
+                    return
+                await player.play(next_track)
+    if next_track is None:
+        next_track = await play_next(player)  # Resolve and play the next track from the queue.
+    if next_track:
         if getattr(player, "text_channel", None):  # Check if a text channel is associated with the player.
-            embed = make_embed("Now Playing", f"🎶 **{next_track.title}** by **{next_track.author}**")  # Create an embed for the now playing track.
-            await player.text_channel.send(embed=embed)  # Send the embed to the text channel.
-    else:
-        await player.disconnect()  # Disconnect the player if the queue is empty.
+            show_now_playing(player.text_channel, next_track)  # Update the channel's now playing message.
+    elif not IDLE_TIMEOUT and not player.playing:
+        await player.disconnect()  # Disconnect right away if no idle grace period is configured.
+    # Otherwise wavelink's inactivity timer fires on_wavelink_inactive_player after IDLE_TIMEOUT seconds.
+
+async def on_wavelink_track_start(payload: wavelink.TrackStartEventPayload):
+    player = payload.player  # Get the player instance from the payload.
+    if not isinstance(player, MusicPlayer):
+        return
+    schedule_preload(player, player.start_position)  # Get the next track ready before this one ends.
+    player.start_position = 0  # Only the restored track starts part way through.
+
+##############################
+# Event: Leave idle and empty voice channels
+##############################
+async def on_wavelink_inactive_player(player: wavelink.Player):
+    """Fired by wavelink after IDLE_TIMEOUT seconds without playback, or after several tracks with no listeners."""
+    if not player.connected:
+        return
+    if getattr(player, "text_channel", None):
+        send_embed(player.text_channel, make_embed("Disconnected", "👋 Left the voice channel due to inactivity."))  # Let the channel know why.
+    cancel_resolution(player)  # Drop any searches still pending for this guild.
+    await player.disconnect()  # Free the voice connection and the node's player.
+
+def has_listeners(channel) -> bool:
+    return any(not member.bot for member in channel.members)  # Bots don't count as listeners.
+
+async def leave_empty_channel(player: MusicPlayer):
+    await asyncio.sleep(EMPTY_CHANNEL_TIMEOUT)  # Give listeners a moment to come back.
+    if not player.connected or not player.channel or has_listeners(player.channel):
+        return  # Someone came back, or the player already left.
+    if getattr(player, "text_channel", None):
+        send_embed(player.text_channel, make_embed("Disconnected", "👋 Left the voice channel because nobody is listening."))  # Let the channel know why.
+    cancel_resolution(player)  # Drop any searches still pending for this guild.
+    await player.disconnect()  # Free the voice connection and the node's player.
+
+async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+    player = member.guild.voice_client  # The guild's player, if the bot is in voice.
+    if not isinstance(player, MusicPlayer) or not player.channel:
+        return
+    if player.channel not in (before.channel, after.channel):
+        return  # Someone joined or left a different channel.
+    if has_listeners(player.channel):
+        if player.empty_task and not player.empty_task.done():
+            player.empty_task.cancel()  # A listener is back; stay.
+    elif player.empty_task is None or player.empty_task.done():
+        player.empty_task = asyncio.create_task(leave_empty_channel(player))  # Leave unless someone joins soon.
+
+async def on_guild_remove(guild: discord.Guild):
+    release_dispatchers(guild.id, forget=True)  # Nothing can be sent to the guild's channels any more.
+
+##############################
+# Helper: Apply guild settings
+##############################
+async def apply_guild_settings(ctx: commands.Context, player: wavelink.Player):
+    """Apply the guild's saved text channel and volume to the player."""
+    settings = await guild_settings.get(ctx.guild.id)  # Read the guild's settings from the cache.
+    channel = ctx.guild.get_channel(settings["text_channel_id"]) if settings["text_channel_id"] else None  # Look up the configured text channel.
+    player.text_channel = channel or ctx.channel  # Announce in the configured channel, or where the command was issued.
+    if settings["volume"] is not None and settings["volume"] != player.volume:  # If there is a saved volume setting for this guild.
+        await player.set_volume(settings["volume"])  # Set the player's volume to the saved value.
 
 ##############################
 # Helper: Connect to voice channel
 ##############################
 async def connect_to_voice(ctx: commands.Context) -> wavelink.Player:
     if not ctx.author.voice or not ctx.author.voice.channel:  # Check if the user is in a voice channel.
-        await ctx.send(embed=make_embed("Error", "You need to join a voice channel first!", discord.Color.red()))  # Send an error embed if not.
+        send_embed(ctx.channel, make_embed("Error", "You need to join a voice channel first!", discord.Color.red()))  # Send an error embed if not.
         return None  # Return None to indicate failure.
     channel = ctx.author.voice.channel  # Get the voice channel the user is in.
     if ctx.voice_client is None:  # If the bot is not connected to any voice channel.
-        player: wavelink.Player = await channel.connect(cls=wavelink.Player)  # Connect the bot to the user's voice channel.
+        if not await wait_for_node():  # Nodes may still be connecting right after a restart.
+            send_embed(ctx.channel, make_embed("Error", "The music servers are still starting up, please try again in a moment.", discord.Color.red()))  # Report the missing node.
+            return None  # Return None to indicate failure.
+        player: MusicPlayer = await channel.connect(cls=MusicPlayer)  # Connect the bot to the user's voice channel.
     else:
         player: wavelink.Player = ctx.voice_client  # Use the existing voice client.
         if player.channel != channel:  # If the bot is connected to a different channel.
             await player.move_to(channel)  # Move the bot to the user's voice channel.
-    player.text_channel = ctx.channel  # Set the text channel attribute to the channel where the command was issued.
     player.autoplay = wavelink.AutoPlayMode.disabled  # Disable autoplay mode.
-    guild_id = str(ctx.guild.id)  # Get the guild ID as a string.
-    if guild_id in volume_settings:  # If there is a saved volume setting for this guild.
-        saved_volume = volume_settings[guild_id]  # Retrieve the saved volume.
-        await player.set_volume(saved_volume)  # Set the player's volume to the saved value.
+    await apply_guild_settings(ctx, player)  # Apply the guild's saved settings.
     return player  # Return the connected player.
 
 ##############################
 # Command: join
 ##############################
-@bot.command(name="join", help="Join your voice channel.")
+@commands.command(name="join", help="Join your voice channel.")
 async def join(ctx: commands.Context):
     if not ctx.author.voice or not ctx.author.voice.channel:  # Check if the user is in a voice channel.
-        return await ctx.send(embed=make_embed("Error", "You need to join a voice channel first!", discord.Color.red()))  # Send an error if not.
+        return send_embed(ctx.channel, make_embed("Error", "You need to join a voice channel first!", discord.Color.red()))  # Send an error if not.
     channel = ctx.author.voice.channel  # Get the user's voice channel.
     player: wavelink.Player = ctx.voice_client  # Get the bot's current voice client.
     if player is None:  # If the bot is not connected to any channel.
-        player = await channel.connect(cls=wavelink.Player)  # Connect to the user's voice channel.
+        if not await wait_for_node():  # Nodes may still be connecting right after a restart.
+            return send_embed(ctx.channel, make_embed("Error", "The music servers are still starting up, please try again in a moment.", discord.Color.red()))  # Report the missing node.
+        player = await channel.connect(cls=MusicPlayer)  # Connect to the user's voice channel.
     else:
         if player.channel != channel:  # If connected to a different channel.
             await player.move_to(channel)  # Move to the user's voice channel.
-    player.text_channel = ctx.channel  # Set the text channel attribute.
-    guild_id = str(ctx.guild.id)  # Get the guild ID as a string.
-    if guild_id in volume_settings:  # Check if a saved volume exists for this guild.
-        saved_volume = volume_settings[guild_id]  # Retrieve the saved volume.
-        await player.set_volume(saved_volume)  # Set the player's volume.
-    await ctx.send(embed=make_embed("Connected", f"Joined {channel.mention}!"))  # Send a confirmation embed.
+    await apply_guild_settings(ctx, player)  # Apply the guild's saved settings.
+    send_embed(ctx.channel, make_embed("Connected", f"Joined {channel.mention}!"))  # Send a confirmation embed.
 
 ##############################
 # Command: leave
 ##############################
-@bot.command(name="leave", help="Clear the queue, stop playback, and disconnect from the voice channel.")
+@commands.command(name="leave", help="Clear the queue, stop playback, and disconnect from the voice channel.")
 async def leave(ctx: commands.Context):
     player: wavelink.Player = ctx.voice_client  # Get the bot's voice client.
     if player:
         player.queue.clear()  # Clear the player's queue.
+        cancel_resolution(player)  # Drop searches still pending for this guild.
         if player.playing:  # If a track is currently playing.
             await player.skip(force=True)  # Force skip the current track.
         await player.disconnect()  # Disconnect the player from the voice channel.
-        await ctx.send(embed=make_embed("Disconnected", "Left the voice channel and cleared the queue."))  # Send a confirmation embed.
+        send_embed(ctx.channel, make_embed("Disconnected", "Left the voice channel and cleared the queue."))  # Send a confirmation embed.
     else:
-        await ctx.send(embed=make_embed("Error", "I'm not connected to any voice channel.", discord.Color.red()))  # Send an error if not connected.
+        send_embed(ctx.channel, make_embed("Error", "I'm not connected to any voice channel.", discord.Color.red()))  # Send an error if not connected.
 
 ##############################
 # Command: volume
 ##############################
-@bot.command(name="volume", help="Set the playback volume for the server (0-100).")
+@commands.command(name="volume", help="Set the playback volume for the server (0-100).")
 async def volume(ctx: commands.Context, vol: int):
     if vol < 0 or vol > 100:  # Validate that the volume is within the allowed range.
-        return await ctx.send(embed=make_embed("Error", "Volume must be between 0 and 100.", discord.Color.red()))  # Send an error if invalid.
-    guild_id = str(ctx.guild.id)  # Get the guild ID as a string.
-    volume_settings[guild_id] = vol  # Save the new volume setting for this guild.
-    save_volumes()  # Persist the updated volume settings to file.
+        return send_embed(ctx.channel, make_embed("Error", "Volume must be between 0 and 100.", discord.Color.red()))  # Send an error if invalid.
+    await guild_settings.update(ctx.guild.id, volume=vol)  # Save the new volume setting for this guild in the background.
     player: wavelink.Player = ctx.voice_client  # Get the current voice client.
     if player:
         await player.set_volume(vol)  # Update the player's volume if connected.
-    await ctx.send(embed=make_embed("Volume Set", f"Volume has been set to **{vol}%** for this server."))  # Send a confirmation embed.
+    send_embed(ctx.channel, make_embed("Volume Set", f"Volume has been set to **{vol}%** for this server."))  # Send a confirmation embed.
 
 ##############################
 # Helper: Process Spotify Links
@@ -163,236 +1291,1004 @@ def process_spotify_link(query: str):
     Returns a tuple (spotify_type, spotify_id).
     """
     parsed = urllib.parse.urlparse(query)  # Parse the Spotify URL.
-    path_parts = parsed.path.split("/")  # Split the URL path into parts.
-    if len(path_parts) >= 3:  # Check if the URL has enough parts.
-        return path_parts[1], path_parts[2].split("?")[0]  # Return the type and ID of the Spotify item.
+    path_parts = [part for part in parsed.path.split("/") if part and not part.startswith("intl-")]  # Split the path, dropping locale prefixes like "intl-de".
+    if len(path_parts) >= 2:  # Check if the URL has enough parts.
+        return path_parts[0], path_parts[1]  # Return the type and ID of the Spotify item.
     return None, None  # Return None if extraction fails.
 
+##############################
+# Spotify metadata layer
+##############################
+def spotify_client() -> spotipy.Spotify:
+    """Return the Spotify client, creating it on first use so Spotify setup never delays startup."""
+    global sp
+    if sp is None:
+        if not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET:
+            raise SpotifyException(401, -1, "Spotify credentials are not configured")  # Reported like any other Spotify error.
+        session = requests.Session()  # HTTP session shared by the token and API requests.
+        retry = Retry(total=3, connect=None, read=False, allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]), status=3, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504), respect_retry_after_header=False)  # Retry server errors only; never sleep on Retry-After in the worker thread.
+        session.mount("https://", requests.adapters.HTTPAdapter(max_retries=retry))
+        spotify_auth = SpotifyClientCredentials(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET, requests_session=session)  # Initialize Spotify authentication.
+        sp = spotipy.Spotify(auth_manager=spotify_auth, requests_session=session)  # Create a Spotify client; 429s reach spotify_call with their Retry-After header.
+    return sp
+
+SPOTIFY_ERRORS = (SpotifyException, SpotifyOauthError, requests.exceptions.RequestException)  # API errors, bad credentials, and connection failures or exhausted retries.
+
+def spotify_error_message(error: Exception) -> str:
+    return getattr(error, "msg", None) or getattr(error, "error_description", None) or str(error)  # Only SpotifyException has msg.
+
+async def spotify_call(method, *args, **kwargs):
+    """
+    Run a blocking spotipy method in the Spotify thread pool so the event loop keeps running.
+    Rate-limited calls are retried after Spotify's Retry-After delay, with exponential backoff.
+    """
+    loop = asyncio.get_running_loop()  # Get the loop that owns the executor futures.
+    delay = 1.0  # Minimum wait before retrying, doubled on every attempt.
+    for attempt in range(SPOTIFY_MAX_RETRIES + 1):
+        started = time.perf_counter()  # Time the request.
+        try:
+            return await loop.run_in_executor(spotify_executor, functools.partial(method, *args, **kwargs))  # Call Spotify off the event loop.
+        except SpotifyException as e:
+            if e.http_status != 429:
+                raise  # Only rate limits are retried here.
+            spotify_rate_limits.inc()  # Count rate-limit responses.
+            if attempt == SPOTIFY_MAX_RETRIES:
+                raise  # Give up after the last retry.
+            retry_after = float(e.headers.get("Retry-After", 0) or 0)  # Seconds Spotify asked us to wait.
+        finally:
+            spotify_latency.observe(time.perf_counter() - started, method=method.__name__)  # Record the request latency.
+        await asyncio.sleep(max(retry_after, delay))  # Wait without blocking other guilds.
+        delay = min(delay * 2, 60.0)  # Back off further if we keep getting limited.
+
+class SpotifyTrackBatcher:
+    """
+    Coalesces single-track lookups made close together into batch `sp.tracks` calls
+    of up to 50 IDs, so concurrent track URLs share one Spotify round trip.
+    """
+    batch_size = 50  # Maximum IDs accepted by the Spotify tracks endpoint.
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay  # Seconds to wait for more lookups before sending a batch.
+        self.pending = {}  # Maps track ID -> future waiting for its metadata.
+        self.flush_task = None  # Scheduled flush for the batch being collected.
+        self.tasks = set()  # References to in-flight batch requests.
+
+    async def get(self, track_id: str) -> dict:
+        future = self.pending.get(track_id)  # Reuse a lookup that is already waiting.
+        if future is None:
+            future = asyncio.get_running_loop().create_future()  # Create a future for this ID.
+            self.pending[track_id] = future  # Add it to the current batch.
+            if len(self.pending) >= self.batch_size:
+                self._spawn(self._send(self._take_batch()))  # The batch is full, send it right away.
+            elif self.flush_task is None:
+                self.flush_task = self._spawn(self._flush_later())  # Give other lookups a moment to join the batch.
+        return await asyncio.shield(future)  # Shield so one cancelled caller doesn't cancel the shared lookup.
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)  # Run the coroutine in the background.
+        self.tasks.add(task)  # Keep a reference so it is not garbage collected.
+        task.add_done_callback(self.tasks.discard)  # Forget it once it finishes.
+        return task
+
+    def _take_batch(self) -> dict:
+        batch, self.pending = self.pending, {}  # Hand the collected lookups to the caller.
+        return batch
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.delay)  # Wait for more lookups to arrive.
+        self.flush_task = None  # The next lookup starts a new batch.
+        await self._send(self._take_batch())  # Send whatever has accumulated.
+
+    async def _send(self, batch: dict):
+        if not batch:
+            return  # A full batch was already sent in the meantime.
+        ids = list(batch)  # Track IDs in this batch.
+        try:
+            response = await spotify_call(spotify_client().tracks, ids)  # Fetch metadata for every ID at once.
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)  # Propagate the failure to every waiter.
+            return
+        for track_id, track in zip(ids, response["tracks"]):
+            future = batch[track_id]  # Find the waiter for this ID.
+            if future.done():
+                continue
+            if track is None:
+                future.set_exception(SpotifyException(404, -1, f"Track {track_id} not found"))  # Spotify returns null for unknown IDs.
+            else:
+                future.set_result(track)  # Hand the metadata to the waiter.
+
+spotify_tracks = SpotifyTrackBatcher()  # Shared batcher for single-track lookups.
+
+async def fetch_spotify_pages(method, spotify_id: str, page_size: int, **kwargs) -> list:
+    """Fetch every page of a paginated Spotify endpoint, requesting the remaining pages concurrently."""
+    first = await spotify_call(method, spotify_id, limit=page_size, offset=0, **kwargs)  # The first page tells us the total.
+    offsets = range(page_size, first["total"], page_size)  # Offsets of the remaining pages.
+    pages = await asyncio.gather(*(spotify_call(method, spotify_id, limit=page_size, offset=offset, **kwargs) for offset in offsets))  # Fetch them in parallel; the thread pool bounds concurrency.
+    items = list(first["items"])  # Start with the first page's items.
+    for page in pages:
+        items.extend(page["items"])  # Append the remaining pages in order.
+    return items
+
+def deferred_from_spotify(track: dict) -> DeferredTrack:
+    """Build a DeferredTrack from a Spotify track object, or None for local/unavailable items."""
+    if not track or not track.get("artists"):
+        return None  # Skip local or unavailable tracks.
+    return DeferredTrack(title=track["name"], author=track["artists"][0]["name"], spotify_id=track.get("id"))  # Keep only what is needed to search later.
+
+async def fetch_spotify_collection(spotify_type: str, spotify_id: str) -> list:
+    """Return DeferredTrack entries for every track in a Spotify playlist, album or artist's top tracks."""
+    if spotify_type == "playlist":
+        items = await fetch_spotify_pages(spotify_client().playlist_items, spotify_id, 100, additional_types=("track",))  # Page through the whole playlist.
+        tracks = [item.get("track") for item in items]  # Playlist items wrap the track object.
+    elif spotify_type == "album":
+        tracks = await fetch_spotify_pages(spotify_client().album_tracks, spotify_id, 50)  # Page through the whole album.
+    elif spotify_type == "artist":
+        tracks = (await spotify_call(spotify_client().artist_top_tracks, spotify_id))["tracks"]  # Fetch the artist's top tracks.
+    else:
+        raise ValueError(f"Unsupported Spotify type: {spotify_type}")
+    return [entry for entry in map(deferred_from_spotify, tracks) if entry is not None]  # Drop local or unavailable items.
+
+##############################
+# Admission control
+##############################
+user_command_limits = commands.CooldownMapping.from_cooldown(USER_RATE_LIMIT, RATE_LIMIT_PERIOD, commands.BucketType.user)  # Token bucket per user.
+guild_command_limits = commands.CooldownMapping.from_cooldown(GUILD_RATE_LIMIT, RATE_LIMIT_PERIOD, commands.BucketType.guild)  # Token bucket per guild.
+
+async def admit_command(ctx: commands.Context) -> bool:
+    """Global check: take a token from the user's and the guild's bucket, or reject the command."""
+    buckets = [(user_command_limits.get_bucket(ctx.message), commands.BucketType.user), (guild_command_limits.get_bucket(ctx.message), commands.BucketType.guild)]
+    for bucket, bucket_type in buckets:
+        retry_after = bucket.get_retry_after()  # Seconds until a token is free, or 0.
+        if retry_after:
+            raise commands.CommandOnCooldown(bucket, retry_after, bucket_type)  # Checked before taking any token.
+    for bucket, _ in buckets:
+        bucket.update_rate_limit()  # Take a token from both buckets.
+    return True
+
+async def on_command_error(ctx: commands.Context, error: commands.CommandError):
+    if isinstance(error, commands.CommandOnCooldown):
+        who = "this server" if error.type is commands.BucketType.guild else "you"  # Say which bucket ran dry.
+        send_embed(ctx.channel, make_embed("Slow Down", f"⏳ Too many commands from {who}. Try again in {error.retry_after:.0f}s.", discord.Color.orange()))
+        return
+    await commands.Bot.on_command_error(ctx.bot, ctx, error)  # Report everything else the default way.
+
+class ResolutionScheduler:
+    """
+    Runs resolution jobs (Lavalink searches and Spotify collection fetches) with at most
+    `limit` in flight across all guilds. Free slots go to waiting guilds in turn, so one
+    guild's huge playlist cannot starve the others, and identical jobs that are already
+    in flight are shared instead of being run twice.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit  # Maximum number of jobs running at once.
+        self.running = 0  # Jobs currently holding a slot.
+        self.waiting = OrderedDict()  # Maps guild ID -> futures waiting for a slot; the order is the round robin.
+        self.jobs = {}  # Maps job key -> task running it.
+        self.interest = {}  # Maps job key -> {guild ID: number of callers waiting on it}.
+        self.slots = {}  # Maps job key -> (guild ID, future) while the job waits for a slot.
+
+    async def run(self, guild_id, key, factory):
+        """Run `factory()` as the job `key` for `guild_id`, or wait on the identical job already in flight."""
+        job = self.jobs.get(key)
+        if job is None:
+            job = self.jobs[key] = asyncio.create_task(self._run_job(guild_id, key, factory))  # First caller starts the job.
+        guilds = self.interest.setdefault(key, {})
+        guilds[guild_id] = guilds.get(guild_id, 0) + 1
+        try:
+            return await asyncio.shield(job)  # One caller giving up doesn't cancel the others' job.
+        finally:
+            guilds[guild_id] -= 1
+            if not guilds[guild_id]:
+                del guilds[guild_id]
+            if not guilds:
+                del self.interest[key]
+                if not job.done():
+                    job.cancel()  # Nobody wants the result any more.
+            else:
+                self._rehome(key)  # Charge a still-queued job to a guild that still wants it.
+
+    def _rehome(self, key):
+        slot = self.slots.get(key)
+        guilds = self.interest.get(key)
+        if slot is None or not guilds or slot[0] in guilds:
+            return
+        guild_id, future = slot
+        self._unqueue(guild_id, future)
+        new_guild_id = next(iter(guilds))
+        self.waiting.setdefault(new_guild_id, deque()).append(future)  # Queue behind that guild's earlier jobs.
+        self.slots[key] = (new_guild_id, future)
+
+    def _unqueue(self, guild_id, future):
+        if guild_id in self.waiting:
+            with contextlib.suppress(ValueError):
+                self.waiting[guild_id].remove(future)
+            if not self.waiting[guild_id]:
+                del self.waiting[guild_id]
+
+    async def _run_job(self, guild_id, key, factory):
+        try:
+            await self._acquire(guild_id, key)
+            try:
+                return await factory()
+            finally:
+                self._release()
+        finally:
+            if self.jobs.get(key) is asyncio.current_task():
+                del self.jobs[key]  # Later callers start a fresh job.
+
+    async def _acquire(self, guild_id, key):
+        if self.running < self.limit and not self.waiting:
+            self.running += 1  # A slot is free and nobody is queued ahead of us.
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(guild_id, deque()).append(future)  # Queue behind the guild's earlier jobs.
+        self.slots[key] = (guild_id, future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()  # A slot was handed over just as we were cancelled.
+            else:
+                self._unqueue(self.slots[key][0], future)  # The job may have been moved to another guild.
+            raise
+        finally:
+            del self.slots[key]
+
+    def _release(self):
+        self.running -= 1
+        while self.waiting and self.running < self.limit:
+            guild_id, futures = next(iter(self.waiting.items()))  # Guild whose turn it is.
+            future = futures.popleft()
+            if futures:
+                self.waiting.move_to_end(guild_id)  # Back of the line for its next job.
+            else:
+                del self.waiting[guild_id]
+            if not future.done():
+                self.running += 1
+                future.set_result(None)  # Hand the slot over.
+
+resolution_scheduler = ResolutionScheduler(RESOLVE_CONCURRENCY)  # Shared by every guild.
+
+def cancel_resolution(player: wavelink.Player):
+    """
+    Stop the guild's background resolution (prefetch and preload), e.g. when its queue is
+    cleared. Scheduler jobs that only those tasks were waiting on are cancelled with them;
+    members' own `play` commands keep resolving and still get their reply.
+    """
+    for task in (getattr(player, "prefetch_task", None), getattr(player, "preload_task", None)):
+        if task and not task.done():
+            task.cancel()
+
+##############################
+# Helper: Resolve search queries concurrently
+##############################
+async def lavalink_search(query: str, source=wavelink.TrackSource.YouTubeMusic):
+    """Run a Lavalink search on the least busy search node, recording its latency and failures."""
+    if not await wait_for_node():
+        raise wavelink.InvalidNodeException("No Lavalink nodes are currently available.")  # Gave up waiting for a node.
+    node = select_node("search")  # Spread searches across nodes separately from playback.
+    search_load[node.identifier] = search_load.get(node.identifier, 0) + 1  # Count the search against the node.
+    started = time.perf_counter()  # Time the search.
+    try:
+        return await wavelink.Playable.search(query, source=source, node=node)  # Ask Lavalink for tracks.
+    except Exception:
+        search_failures.inc(node=node.identifier)  # Count the failed search.
+        raise
+    finally:
+        search_load[node.identifier] -= 1  # The search is no longer in flight.
+        search_latency.observe(time.perf_counter() - started, node=node.identifier)  # Record the search latency.
+
+async def search_and_cache(query: str, keys: list, origin: dict) -> wavelink.Playable:
+    results = await lavalink_search(query, source=None)  # The query already carries its search prefix.
+    if not results or isinstance(results, wavelink.Playlist):
+        return None  # Nothing usable was found.
+    results[0].extras = origin  # Cached along with the track, so cache hits can fall back too.
+    await track_cache.put(keys, results[0])  # Remember the resolution for next time.
+    return results[0]  # Return the first result.
+
+async def resolve_track(query: str, spotify_id: str = None, guild_id: int = None) -> wavelink.Playable:
+    """
+    Resolve a single search query to its first result, going through the track cache.
+    Searches are scheduled for `guild_id` and shared with identical ones in flight.
+    Returns None if the search found nothing.
+    """
+    keys = [TrackCache.search_key(query)]  # Always cache by the normalized search string.
+    if spotify_id:
+        keys.insert(0, TrackCache.spotify_key(spotify_id))  # Prefer the Spotify ID when we have one.
+    origin = {"query": query, "spotify_id": spotify_id}  # Lavalink echoes this back, so a failed load can fall back to another result.
+    track = await track_cache.get(*keys)  # Check the cache first; a hit skips the Lavalink search entirely.
+    if track is None:
+        track = await resolution_scheduler.run(guild_id, ("track", *keys), functools.partial(search_and_cache, query, keys, origin))  # Search Lavalink when it's this guild's turn.
+    if track is not None:
+        track.extras = origin  # Also set it on entries cached before extras were stored.
+    return track
+
+async def resolve_in_order(queries: list, spotify_ids: list = None, concurrency: int = SEARCH_CONCURRENCY, guild_id: int = None):
+    """
+    Search Lavalink for each query with at most `concurrency` searches in flight.
+    Yields (index, track, error) tuples in the original order of `queries`, so
+    callers can start using the first result while later ones are still loading.
+    """
+    spotify_ids = spotify_ids or [None] * len(queries)  # Spotify IDs are optional cache keys.
+    pending = []  # Tasks in flight, in the same order as their queries.
+    next_index = 0  # Index of the next query to schedule.
+    try:
+        for index in range(len(queries)):
+            while next_index < len(queries) and len(pending) < max(concurrency, 1):
+                pending.append(asyncio.create_task(resolve_track(queries[next_index], spotify_ids[next_index], guild_id)))  # Schedule the next search.
+                next_index += 1  # Move on to the following query.
+            task = pending.pop(0)  # Take the task for the current query.
+            try:
+                yield index, await task, None  # Hand the result back as soon as it is ready.
+            except Exception as e:
+                yield index, None, e  # Hand the error back so the caller can report it.
+    finally:
+        for task in pending:
+            task.cancel()  # Cancel outstanding searches if the caller stops early.
+
+##############################
+# Helper: Resolve deferred queue entries
+##############################
+async def send_skipped(player: wavelink.Player, skipped: list):
+    """Report queue entries that could not be resolved in a single message."""
+    if not skipped or not getattr(player, "text_channel", None):
+        return  # Nothing to report or nowhere to report it.
+    names = ", ".join(f"{entry.title} - {entry.author}" for entry in skipped[:10])  # List the first few skipped entries.
+    if len(skipped) > 10:
+        names += f" and {len(skipped) - 10} more"  # Mention how many entries were left out.
+    send_embed(player.text_channel, make_embed("Tracks Skipped", f"⚠️ Could not find **{len(skipped)}** tracks: {names}", discord.Color.orange()))  # Send the summary embed.
+
+async def prefetch(player: MusicPlayer):
+    """Resolve the DeferredTrack entries within PREFETCH_WINDOW of the head of the queue."""
+    async with player.resolve_lock:
+        skipped = []  # Entries that could not be resolved.
+        while True:
+            entries = [entry for entry in player.queue[:PREFETCH_WINDOW] if isinstance(entry, DeferredTrack)]  # Unresolved entries near the head.
+            if not entries:
+                break  # The window is fully resolved.
+            failed = None  # Search error that stopped this pass, if any.
+            async with contextlib.aclosing(resolve_in_order([entry.query for entry in entries], [entry.spotify_id for entry in entries], guild_id=player.guild.id)) as results:
+                async for index, track, error in results:
+                    if error is not None:
+                        failed = error  # Lavalink is down or timing out; keep the entries for a later pass.
+                        break
+                    if track is None:
+                        player.queue.discard(entries[index])  # Drop entries that really have no results.
+                        skipped.append(entries[index])  # Remember them for the summary.
+                    else:
+                        player.queue.replace(entries[index], track)  # Swap the placeholder for the resolved track.
+            if failed is not None:
+                print(f"Prefetch for guild {player.guild.id} stopped: {failed}")  # play_next retries the entries when it reaches them.
+                break
+        await send_skipped(player, skipped)  # Report any entries that were dropped.
+
+def schedule_prefetch(player: wavelink.Player):
+    """Start a background prefetch pass for the player if one is not already running."""
+    if not isinstance(player, MusicPlayer) or (player.prefetch_task and not player.prefetch_task.done()):
+        return  # Only MusicPlayer supports deferred entries, and one pass at a time is enough.
+    player.prefetch_task = asyncio.create_task(prefetch(player))  # Keep a reference so the task is not garbage collected.
+
+async def fallback_track(player: MusicPlayer, failed: wavelink.Playable) -> wavelink.Playable:
+    """
+    Find another search result for the query a track that failed to load was resolved from,
+    and cache it in place of the broken one. Returns None if there is no alternative.
+    """
+    player.failed_tracks.add(failed.identifier)  # Never pick this track again for the guild.
+    origin = dict(failed.extras)  # resolve_track records the query in the track's user data.
+    query = origin.get("query")
+    if not query:
+        return None  # Played from a URL; there is nothing to search again.
+    try:
+        results = await resolution_scheduler.run(player.guild.id, ("load", query), functools.partial(lavalink_search, query, source=None))  # Usually answered from wavelink's search cache.
+    except Exception:
+        return None  # Treat search errors like missing results.
+    if not results or isinstance(results, wavelink.Playlist):
+        return None
+    for track in results:
+        if track.identifier not in player.failed_tracks:
+            keys = [TrackCache.search_key(query)]  # Same keys resolve_track uses.
+            if origin.get("spotify_id"):
+                keys.insert(0, TrackCache.spotify_key(origin["spotify_id"]))
+            track.extras = origin  # Keep the origin so this one can fall back too.
+            await track_cache.put(keys, track)  # Stop handing out the broken result.
+            return track
+    return None
+
+def track_position(player: wavelink.Player) -> int:
+    """
+    Milliseconds into the current track, by the player's own clock. wavelink's position only
+    moves on Lavalink's periodic updates and still holds the previous track's until the first one.
+    """
+    started, position = getattr(player, "track_clock", (0.0, 0))
+    if player.paused:
+        return position  # The clock stopped when playback was paused.
+    return position + int((time.monotonic() - started) * 1000)
+
+def schedule_preload(player: wavelink.Player, position: int):
+    """(Re)start the preload for the current track, which is `position` ms in. Paused players wait for resume."""
+    if not isinstance(player, MusicPlayer):
+        return
+    if player.preload_task and not player.preload_task.done():
+        player.preload_task.cancel()  # Its timing no longer matches the playback.
+    player.preload_task = None
+    player.track_clock = (time.monotonic(), position)  # Restart the clock from here.
+    if player.current is not None and not player.paused:
+        player.preload_task = asyncio.create_task(preload(player, player.current, position))
+
+async def preload(player: MusicPlayer, current: wavelink.Playable, position: int = 0):
+    """
+    Shortly before `current` ends, make sure the next queue entry is resolved and not a
+    track that already failed to load, so the next track starts without a search.
+    `position` is how far into `current` playback is now.
+    """
+    if not current.is_stream:
+        await asyncio.sleep(max((current.length - position) / 1000 - PRELOAD_SECONDS, 0))  # Wait until the end is near.
+    if not player.connected:
+        return
+    schedule_prefetch(player)  # Resolve the head of the queue if it is still deferred.
+    if player.prefetch_task:
+        await asyncio.wait({player.prefetch_task})  # Wait without being cancelled along with it.
+    if player.queue.is_empty or player.queue.mode is wavelink.QueueMode.loop:
+        return  # In loop mode the current track repeats; the queue head is not next.
+    entry = player.queue.peek(0)  # The next track to play.
+    if isinstance(entry, wavelink.Playable) and entry.identifier in player.failed_tracks:
+        replacement = await fallback_track(player, entry)  # Swap a known-broken track before it is played.
+        if replacement is not None:
+            player.queue.replace(entry, replacement)
+        else:
+            player.queue.discard(entry)
+
+async def play_next(player: wavelink.Player) -> wavelink.Playable:
+    """
+    Take the next entry from the queue, resolving it first if it is still deferred, and play it.
+    Returns the track that started playing, or None if the queue ran out or a track is already playing.
+    """
+    async with player.play_lock:  # Resolving the head can take a while; don't let another caller start a track meanwhile.
+        if player.playing:
+            schedule_prefetch(player)  # Another caller already started a track; just resolve what was queued.
+            return None
+        skipped = []  # Entries that could not be resolved.
+        while True:
+            try:
+                entry = player.queue.get()  # Retrieve the next entry from the queue.
+            except wavelink.QueueEmpty:
+                await send_skipped(player, skipped)  # Report any entries that were dropped.
+                return None  # Nothing left to play.
+            if isinstance(entry, DeferredTrack):
+                for attempt in range(SEARCH_RETRIES + 1):
+                    try:
+                        track = await resolve_track(entry.query, entry.spotify_id, player.guild.id)  # Resolve the entry right away.
+                        break
+                    except Exception as e:
+                        error = e  # Lavalink is down or timing out, which is not the same as "no results".
+                    if attempt < SEARCH_RETRIES:
+                        await asyncio.sleep(2 ** attempt)  # Back off before searching again.
+                else:
+                    if player.queue.mode is not wavelink.QueueMode.loop:
+                        player.queue.put_at(0, entry)  # Keep the entry at the head instead of dropping it.
+                    await send_skipped(player, skipped)  # Report any entries that were dropped.
+                    if getattr(player, "text_channel", None):
+                        send_embed(player.text_channel, make_embed("Search Unavailable", f"⚠️ Could not search for **{entry.title}** right now ({error}). The queue was kept and playback picks up from here on the next b!play.", discord.Color.orange()))  # Tell the channel why playback stopped.
+                    return None
+                if track is None:
+                    skipped.append(entry)  # Remember the entry for the summary.
+                    continue  # Move on to the next entry.
+                entry = track  # Use the resolved track.
+            await player.play(entry)  # Play the track.
+            schedule_prefetch(player)  # Resolve the upcoming entries in the background.
+            await send_skipped(player, skipped)  # Report any entries that were dropped.
+            return entry  # Return the track that started playing.
+
 ##############################
 # Command: play
 ##############################
-@bot.command(name="play", aliases=["p"], help="Play a song from YouTube or Spotify URL, or search query.")
+@commands.command(name="play", aliases=["p"], help="Play a song from YouTube or Spotify URL, or search query.")
 async def play(ctx: commands.Context, *, query: str):
     player = await connect_to_voice(ctx)  # Connect to the user's voice channel.
     if not player:
         return  # Exit if connection failed.
 
+    tracks = None  # Search results, filled early when the cache already knows the track.
+    spotify_track_id = None  # Spotify ID of a single-track URL, used as a cache key.
     # Check if the query is a Spotify URL
     if "open.spotify.com" in query:
         spotify_type, spotify_id = process_spotify_link(query)  # Process the Spotify URL.
         if spotify_type == "track":
-            # Get track details from Spotify
-            track_info = sp.track(spotify_id)  # Fetch track details from Spotify API.
-            track_name = track_info["name"]  # Extract the track name.
-            artist_name = track_info["artists"][0]["name"]  # Extract the artist name.
-            query = f"ytsearch:{track_name} {artist_name}"  # Convert to a YouTube search query.
-        elif spotify_type == "playlist":
-            # For playlists, retrieve tracks and convert to YouTube search queries.
-            playlist_data = sp.playlist_tracks(spotify_id)  # Fetch playlist tracks from Spotify.
-            queries = []  # Initialize an empty list for search queries.
-            for item in playlist_data["items"]:
-                track = item["track"]  # Get track details from each item.
-                if track is None:  # Skip local or unavailable tracks.
-                    continue
-                track_name = track["name"]  # Get the track name.
-                artist_name = track["artists"][0]["name"]  # Get the artist name.
-                queries.append(f"ytsearch:{track_name} {artist_name}")  # Append the YouTube search query.
-            results = []  # Initialize an empty list for search results.
-            for q in queries:
+            spotify_track_id = spotify_id  # Remember the ID so the resolution is cached under it.
+            cached = await track_cache.get(TrackCache.spotify_key(spotify_id))  # Skip Spotify and Lavalink on a cache hit.
+            if cached is not None and dict(cached.extras).get("query"):
+                tracks = [cached]  # Use the cached resolution; its extras carry the query for fallback_track.
+            else:
+                # Get track details from Spotify
                 try:
-                    res = await wavelink.Playable.search(q)  # Search for the track on YouTube.
-                    if res:
-                        results.append(res[0])  # Append the first result if available.
-                except Exception as e:
-                    print(f"Error searching for {q}: {e}")  # Print an error message if search fails.
-            if results:
-                await player.queue.put_wait(results)  # Add the found tracks to the player's queue.
-                await ctx.send(embed=make_embed("Playlist Added", f"➕ Added **{len(results)}** tracks from Spotify playlist to the queue."))  # Send a confirmation embed.
-                if not player.playing:
-                    next_track = player.queue.get()  # Get the next track in the queue.
-                    await player.play(next_track)  # Play the next track.
-                    await ctx.send(embed=make_embed("Now Playing", f"🎶 Now playing: **{next_track.title}** by **{next_track.author}**"))  # Send now playing embed.
+                    track_info = await spotify_tracks.get(spotify_id)  # Fetch track details from Spotify API in a batch.
+                except SPOTIFY_ERRORS as e:
+                    return send_embed(ctx.channel, make_embed("Error", f"Could not fetch the Spotify track: {spotify_error_message(e)}", discord.Color.red()))  # Report Spotify errors.
+                track_name = track_info["name"]  # Extract the track name.
+                artist_name = track_info["artists"][0]["name"]  # Extract the artist name.
+                query = f"ytsearch:{track_name} {artist_name}"  # Convert to a YouTube search query.
+        elif spotify_type in ("playlist", "album", "artist"):
+            # For collections, retrieve every track and queue deferred YouTube searches.
+            try:
+                entries = await resolution_scheduler.run(ctx.guild.id, ("spotify", spotify_type, spotify_id), functools.partial(fetch_spotify_collection, spotify_type, spotify_id))  # Fetch all pages from Spotify, sharing identical fetches in flight.
+            except SPOTIFY_ERRORS as e:
+                return send_embed(ctx.channel, make_embed("Error", f"Could not fetch the Spotify {spotify_type}: {spotify_error_message(e)}", discord.Color.red()))  # Report Spotify errors.
+            if not entries:
+                return send_embed(ctx.channel, make_embed("Error", f"No tracks were found for the Spotify {spotify_type}.", discord.Color.red()))  # Inform the user if no tracks were found.
+            await player.queue.put_wait(entries)  # Add the placeholders to the player's queue.
+            next_track = None  # Track that started playing, if nothing was playing before.
+            if not player.playing:
+                next_track = await play_next(player)  # Resolve and play the first track before confirming, so both embeds go out together.
             else:
-                await ctx.send(embed=make_embed("Error", "No tracks were found for the Spotify playlist.", discord.Color.red()))  # Inform the user if no tracks were found.
-            return  # Exit the command after processing the playlist.
+                schedule_prefetch(player)  # Resolve the next few entries in the background.
+            send_embed(ctx.channel, make_embed("Playlist Added", f"➕ Added **{len(entries)}** tracks from Spotify {spotify_type} to the queue."))  # Send a confirmation embed.
+            if next_track:
+                show_now_playing(player.text_channel, next_track)  # Update the channel's now playing message.
+            return  # Exit the command after processing the collection.
         else:
-            return await ctx.send(embed=make_embed("Error", "Unsupported Spotify URL type.", discord.Color.red()))  # Send error if URL type is unsupported.
+            return send_embed(ctx.channel, make_embed("Error", "Unsupported Spotify URL type.", discord.Color.red()))  # Send error if URL type is unsupported.
     
-    # If the query is not a URL (or has been converted from a Spotify URL), assume a YouTube search.
-    if not query.startswith("http://") and not query.startswith("https://"):
-        query = f"ytsearch:{query}"  # Prepend "ytsearch:" to treat the query as a YouTube search.
-
-    try:
-        tracks = await wavelink.Playable.search(query)  # Search for tracks using the query.
-    except Exception as e:
-        return await ctx.send(embed=make_embed("Error", f"Error fetching track: {e}", discord.Color.red()))  # Send an error if the search fails.
+    if tracks is None:
+        # If the query is not a URL (or has been converted from a Spotify URL), assume a YouTube search.
+        if not query.startswith(("http://", "https://", "ytsearch:")):
+            query = f"ytsearch:{query}"  # Prepend "ytsearch:" to treat the query as a YouTube search.
+        try:
+            if query.startswith("ytsearch:"):
+                track = await resolve_track(query, spotify_track_id, ctx.guild.id)  # Search through the track cache.
+                tracks = [track] if track else []  # Normalize to a list of results.
+            else:
+                tracks = await resolution_scheduler.run(ctx.guild.id, ("load", query), functools.partial(lavalink_search, query))  # Load tracks or playlists from the URL.
+        except Exception as e:
+            return send_embed(ctx.channel, make_embed("Error", f"Error fetching track: {e}", discord.Color.red()))  # Send an error if the search fails.
     if not tracks:
-        return await ctx.send(embed=make_embed("Error", "No results found for your query.", discord.Color.red()))  # Inform the user if no tracks were found.
+        return send_embed(ctx.channel, make_embed("Error", "No results found for your query.", discord.Color.red()))  # Inform the user if no tracks were found.
     if isinstance(tracks, wavelink.Playlist):
         added = await player.queue.put_wait(tracks)  # Add all tracks from the playlist to the queue.
-        await ctx.send(embed=make_embed("Playlist Added", f"➕ Added **{added}** tracks from playlist **{tracks.name}** to the queue."))  # Send a confirmation embed.
+        embed = make_embed("Playlist Added", f"➕ Added **{added}** tracks from playlist **{tracks.name}** to the queue.")  # Confirmation embed.
     else:
         track: wavelink.Playable = tracks[0]  # Select the first track from the search results.
         added = await player.queue.put_wait(track)  # Add the track to the queue.
-        await ctx.send(embed=make_embed("Track Added", f"➕ Added **{track.title}** by **{track.author}** to the queue."))  # Send a confirmation embed.
-    if not player.playing:
-        next_track = player.queue.get()  # Retrieve the next track if nothing is currently playing.
-        await player.play(next_track)  # Start playback of the next track.
-        await ctx.send(embed=make_embed("Now Playing", f"🎶 Now playing: **{next_track.title}** by **{next_track.author}**"))  # Inform the channel which track is playing.
+        embed = make_embed("Track Added", f"➕ Added **{track.title}** by **{track.author}** to the queue.")  # Confirmation embed.
+    next_track = await play_next(player) if not player.playing else None  # Start playback of the next track if nothing is currently playing.
+    send_embed(ctx.channel, embed)  # Send the confirmation; it is merged with the now playing update below.
+    if next_track:
+        show_now_playing(player.text_channel, next_track)  # Update the channel's now playing message.
+
+##############################
+# Command: cache (admin)
+##############################
+@commands.group(name="cache", invoke_without_command=True, help="Show track cache statistics (bot owner only).")
+@commands.is_owner()
+async def cache_cmd(ctx: commands.Context):
+    stats = await track_cache.stats()  # Collect the cache counters.
+    description = (
+        f"**Entries:** {stats['memory_entries']} in memory, {stats['disk_entries']} on disk\n"
+        f"**Hits:** {stats['memory_hits']} memory, {stats['disk_hits']} disk\n"
+        f"**Misses:** {stats['misses']}\n"
+        f"**Hit ratio:** {stats['hit_ratio']:.1%}"
+    )  # Format the counters for display.
+    send_embed(ctx.channel, make_embed("Track Cache", description))  # Send the statistics embed.
+
+@cache_cmd.command(name="purge", help="Remove every entry from the track cache (bot owner only).")
+@commands.is_owner()
+async def cache_purge(ctx: commands.Context):
+    removed = await track_cache.purge()  # Empty both cache tiers.
+    send_embed(ctx.channel, make_embed("Track Cache", f"🗑️ Purged **{removed}** cached tracks."))  # Send a confirmation embed.
 
 ##############################
 # Command: pause
 ##############################
-@bot.command(name="pause", help="Pause the current playback.")
+@commands.command(name="pause", help="Pause the current playback.")
 async def pause(ctx: commands.Context):
     player: wavelink.Player = ctx.voice_client  # Get the current voice client.
     if player and player.playing:  # Check if there is a player and it is currently playing.
+        position = track_position(player)  # Where playback stops.
         await player.pause(True)  # Pause the playback.
-        await ctx.send(embed=make_embed("Paused", "⏸️ Paused the music."))  # Send a confirmation embed.
+        schedule_preload(player, position)  # Hold the preload until playback resumes.
+        send_embed(ctx.channel, make_embed("Paused", "⏸️ Paused the music."))  # Send a confirmation embed.
     else:
-        await ctx.send(embed=make_embed("Error", "No music is playing to pause.", discord.Color.red()))  # Inform the user if nothing is playing.
+        send_embed(ctx.channel, make_embed("Error", "No music is playing to pause.", discord.Color.red()))  # Inform the user if nothing is playing.
 
 ##############################
 # Command: resume
 ##############################
-@bot.command(name="resume", help="Resume paused playback.")
+@commands.command(name="resume", help="Resume paused playback.")
 async def resume(ctx: commands.Context):
     player: wavelink.Player = ctx.voice_client  # Get the current voice client.
     if player and player.paused:  # Check if the player is paused.
+        position = track_position(player)  # Where playback picks up again.
         await player.pause(False)  # Resume playback.
-        await ctx.send(embed=make_embed("Resumed", "▶️ Resumed the music."))  # Send a confirmation embed.
+        schedule_preload(player, position)  # Time the preload from here.
+        send_embed(ctx.channel, make_embed("Resumed", "▶️ Resumed the music."))  # Send a confirmation embed.
     else:
-        await ctx.send(embed=make_embed("Error", "The music is not paused or there's nothing to resume.", discord.Color.red()))  # Inform the user if nothing is paused.
+        send_embed(ctx.channel, make_embed("Error", "The music is not paused or there's nothing to resume.", discord.Color.red()))  # Inform the user if nothing is paused.
 
 ##############################
 # Command: stop
 ##############################
-@bot.command(name="stop", help="Stop playback and clear the queue.")
+@commands.command(name="stop", help="Stop playback and clear the queue.")
 async def stop(ctx: commands.Context):
     player: wavelink.Player = ctx.voice_client  # Get the current voice client.
     if player:
         player.queue.clear()  # Clear the player's queue.
+        cancel_resolution(player)  # Drop searches still pending for this guild.
         await player.skip(force=True)  # Force skip the current track.
         await player.disconnect()  # Disconnect from the voice channel.
-        await ctx.send(embed=make_embed("Stopped", "⏹️ Stopped playback and cleared the queue."))  # Send a confirmation embed.
+        send_embed(ctx.channel, make_embed("Stopped", "⏹️ Stopped playback and cleared the queue."))  # Send a confirmation embed.
     else:
-        await ctx.send(embed=make_embed("Error", "Bot is not connected to a voice channel.", discord.Color.red()))  # Inform the user if the bot is not connected.
+        send_embed(ctx.channel, make_embed("Error", "Bot is not connected to a voice channel.", discord.Color.red()))  # Inform the user if the bot is not connected.
 
 ##############################
 # Command: skip
 ##############################
-@bot.command(name="skip", aliases=["next"], help="Skip the current song.")
+@commands.command(name="skip", aliases=["next"], help="Skip the current song.")
 async def skip(ctx: commands.Context):
     player: wavelink.Player = ctx.voice_client  # Get the current voice client.
     if player and player.playing:  # Check if a track is currently playing.
         await player.skip()  # Skip the current track.
-        await ctx.send(embed=make_embed("Skipped", "⏭️ Skipped the current track."))  # Send a confirmation embed.
+        send_embed(ctx.channel, make_embed("Skipped", "⏭️ Skipped the current track."))  # Send a confirmation embed.
     else:
-        await ctx.send(embed=make_embed("Error", "No music is playing to skip.", discord.Color.red()))  # Inform the user if nothing is playing.
+        send_embed(ctx.channel, make_embed("Error", "No music is playing to skip.", discord.Color.red()))  # Inform the user if nothing is playing.
+
+##############################
+# Queue paginator
+##############################
+QUEUE_PAGE_SIZE = 10  # Tracks shown per queue page.
+queue_paginators = {}  # Maps guild ID -> the QueuePaginator shared by everyone viewing that guild's queue.
+
+def render_queue_page(player: wavelink.Player, page: int) -> tuple:
+    """
+    Build the embed for one page of the queue, reading only that page's slice of the queue.
+    Returns (embed, page, pages_count) with `page` clamped to the pages that exist.
+    """
+    total_tracks = len(player.queue)  # Number of entries waiting in the queue.
+    pages_count = max((total_tracks + QUEUE_PAGE_SIZE - 1) // QUEUE_PAGE_SIZE, 1)  # Calculate total number of pages.
+    page = min(max(page, 0), pages_count - 1)  # The queue may have shrunk since the page was chosen.
+    start_index = page * QUEUE_PAGE_SIZE  # Calculate the starting index for the page.
+    lines = []  # Lines of the page description.
+    if page == 0 and player.playing and player.current:  # For the first page, include the currently playing track.
+        lines += [f"**Now Playing:** {player.current.title} by {player.current.author}", ""]
+    lines.append(f"**Up Next (Page {page + 1}/{pages_count}):**")  # Page header.
+    for i, entry in enumerate(player.queue[start_index:start_index + QUEUE_PAGE_SIZE], start=start_index + 1):
+        lines.append(f"`{i}.` {entry.title} by {entry.author}")  # One line per queued entry.
+    return make_embed("Queue", "\n".join(lines)), page, pages_count
+
+class QueueJumpModal(discord.ui.Modal, title="Go to page"):
+    page = discord.ui.TextInput(label="Page number", placeholder="1", max_length=6)
+
+    def __init__(self, paginator: "QueuePaginator"):
+        super().__init__()
+        self.paginator = paginator  # Paginator to move.
+
+    async def on_submit(self, interaction: discord.Interaction):
+        if not self.page.value.strip().isdigit():
+            return await interaction.response.send_message(embed=make_embed("Error", "Please enter a page number.", discord.Color.red()), ephemeral=True)
+        await self.paginator.show(interaction, int(self.page.value) - 1)  # Pages are numbered from 1 for users.
+
+class QueueSearchModal(discord.ui.Modal, title="Search the queue"):
+    query = discord.ui.TextInput(label="Title or artist", max_length=100)
+
+    def __init__(self, paginator: "QueuePaginator"):
+        super().__init__()
+        self.paginator = paginator  # Paginator whose queue is searched.
+
+    async def on_submit(self, interaction: discord.Interaction):
+        player: wavelink.Player = self.paginator.guild.voice_client  # Get the current voice client.
+        needle = self.query.value.strip().lower()  # Match case-insensitively.
+        matches = []  # (position, entry) pairs, in queue order.
+        for position, entry in enumerate(player.queue if player else [], start=1):
+            if needle in entry.title.lower() or needle in entry.author.lower():
+                matches.append((position, entry))  # Remember where the entry is.
+                if len(matches) == QUEUE_PAGE_SIZE:
+                    break  # One page of results is enough.
+        if not matches:
+            return await interaction.response.send_message(embed=make_embed("Queue Search", f"No queued tracks match **{self.query.value}**."), ephemeral=True)
+        description = "\n".join(f"`{position}.` {entry.title} by {entry.author} (page {(position - 1) // QUEUE_PAGE_SIZE + 1})" for position, entry in matches)  # List matches with their pages.
+        await interaction.response.send_message(embed=make_embed("Queue Search", description), ephemeral=True)  # Only the searcher sees the results.
+
+class QueuePaginator(discord.ui.View):
+    """
+    Buttons for paging through a guild's queue. Pages are rendered when shown, and one
+    paginator per guild is shared by everyone, moving to the newest queue message.
+    """
+
+    def __init__(self, guild: discord.Guild):
+        super().__init__(timeout=120)
+        self.guild = guild  # Guild whose queue is shown.
+        self.page = 0  # Page currently shown.
+        self.message = None  # Message the buttons are attached to.
+
+    def render(self) -> tuple:
+        """Render the current page and update the buttons. Returns (embed, pages_count)."""
+        player: wavelink.Player = self.guild.voice_client  # Get the current voice client.
+        if not player:
+            return make_embed("Info", "ℹ️ No songs are playing or queued."), 1  # The bot left while the queue was open.
+        embed, self.page, pages_count = render_queue_page(player, self.page)  # Render only the visible slice.
+        self.previous_page.disabled = self.page == 0  # Nothing before the first page.
+        self.next_page.disabled = self.page >= pages_count - 1  # Nothing after the last page.
+        return embed, pages_count
+
+    async def attach(self, ctx: commands.Context):
+        """Send the first page in the command's channel, taking the buttons off the previous queue message."""
+        old_message = self.message  # Message that showed the queue before.
+        self.page = 0  # Every queue command starts from the top.
+        embed, pages_count = self.render()
+        if pages_count > 1:
+            self.message = await send_embed(ctx.channel, embed, view=self)  # Wait for the message the buttons live on.
+        else:
+            self.message = None  # A single page needs no buttons.
+            send_embed(ctx.channel, embed)
+        if old_message is not None:
+            with contextlib.suppress(discord.HTTPException):
+                await old_message.edit(view=None)  # Only the newest message keeps the buttons.
+
+    async def show(self, interaction: discord.Interaction, page: int):
+        self.page = page  # Move to the requested page.
+        embed, _ = self.render()
+        await interaction.response.edit_message(embed=embed, view=self)  # Flip the page in a single API call.
+
+    async def on_timeout(self):
+        if queue_paginators.get(self.guild.id) is self:
+            del queue_paginators[self.guild.id]  # The next queue command starts a fresh paginator.
+        if self.message is not None:
+            with contextlib.suppress(discord.HTTPException):
+                await self.message.edit(view=None)  # Remove the stale buttons.
+
+    @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show(interaction, self.page - 1)
+
+    @discord.ui.button(emoji="▶️", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show(interaction, self.page + 1)
+
+    @discord.ui.button(label="Go to page", emoji="🔢", style=discord.ButtonStyle.secondary)
+    async def jump(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.send_modal(QueueJumpModal(self))  # Ask for the page number.
+
+    @discord.ui.button(label="Search", emoji="🔎", style=discord.ButtonStyle.secondary)
+    async def search(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.send_modal(QueueSearchModal(self))  # Ask for the search text.
 
 ##############################
 # Command: queue (with pagination)
 ##############################
-@bot.command(name="queue", aliases=["q"], help="Show the upcoming songs in the queue with pagination.")
+@commands.command(name="queue", aliases=["q"], help="Show the upcoming songs in the queue with pagination.")
 async def queue_cmd(ctx: commands.Context):
     player: wavelink.Player = ctx.voice_client  # Get the current voice client.
     if not player or (not player.playing and player.queue.is_empty):  # Check if there is no music playing or queued.
-        return await ctx.send(embed=make_embed("Info", "ℹ️ No songs are playing or queued."))  # Inform the user if the queue is empty.
-    queue_tracks = list(player.queue.copy())  # Copy the current queue to a list.
-    total_tracks = len(queue_tracks)  # Get the total number of tracks in the queue.
-    tracks_per_page = 10  # Define the number of tracks per page for pagination.
-    pages_count = (total_tracks + tracks_per_page - 1) // tracks_per_page if total_tracks else 1  # Calculate total number of pages.
-    pages = []  # Initialize a list to hold page descriptions.
-    for page in range(pages_count):  # Iterate over each page.
-        start_index = page * tracks_per_page  # Calculate the starting index for the page.
-        end_index = start_index + tracks_per_page  # Calculate the ending index for the page.
-        description = ""  # Initialize the page description.
-        if page == 0 and player.playing and player.current:  # For the first page, include the currently playing track.
-            description += f"**Now Playing:** {player.current.title} by {player.current.author}\n\n"  # Append current track info.
-        description += f"**Up Next (Page {page+1}/{pages_count}):**\n"  # Append page header info.
-        for i, track in enumerate(queue_tracks[start_index:end_index], start=start_index + 1):  # Enumerate tracks for this page.
-            description += f"`{i}.` {track.title} by {track.author}\n"  # Append each track's info.
-        pages.append(description)  # Add the page description to the pages list.
-    embed = make_embed("Queue", pages[0])  # Create an embed with the first page of the queue.
-    message = await ctx.send(embed=embed)  # Send the embed message.
-    if pages_count > 1:  # If there are multiple pages, add pagination reactions.
-        await message.add_reaction("◀️")  # Add the previous page reaction.
-        await message.add_reaction("▶️")  # Add the next page reaction.
-        current_page = 0  # Initialize the current page index.
-        def check(reaction, user):  # Define a check function for reaction events.
-            return (user == ctx.author and str(reaction.emoji) in ["◀️", "▶️"] and reaction.message.id == message.id)
-        while True:
-            try:
-                reaction, user = await bot.wait_for("reaction_add", timeout=60.0, check=check)  # Wait for a valid reaction.
-                if str(reaction.emoji) == "▶️" and current_page < pages_count - 1:  # If next page reaction and not on last page.
-                    current_page += 1  # Increment the current page index.
-                    new_embed = make_embed("Queue", pages[current_page])  # Create a new embed for the new page.
-                    await message.edit(embed=new_embed)  # Edit the message with the new embed.
-                    await message.remove_reaction(reaction, user)  # Remove the user's reaction.
-                elif str(reaction.emoji) == "◀️" and current_page > 0:  # If previous page reaction and not on first page.
-                    current_page -= 1  # Decrement the current page index.
-                    new_embed = make_embed("Queue", pages[current_page])  # Create a new embed for the new page.
-                    await message.edit(embed=new_embed)  # Edit the message with the new embed.
-                    await message.remove_reaction(reaction, user)  # Remove the user's reaction.
-                else:
-                    await message.remove_reaction(reaction, user)  # Remove the reaction if it doesn't change the page.
-            except Exception:
-                break  # Exit the loop if waiting for a reaction times out.
+        return send_embed(ctx.channel, make_embed("Info", "ℹ️ No songs are playing or queued."))  # Inform the user if the queue is empty.
+    paginator = queue_paginators.get(ctx.guild.id)  # Reuse the guild's paginator if it is still live.
+    if paginator is None or paginator.is_finished():
+        paginator = queue_paginators[ctx.guild.id] = QueuePaginator(ctx.guild)  # Start a new one for this guild.
+    await paginator.attach(ctx)  # Show the first page.
 
 ##############################
 # Command: np (Now Playing)
 ##############################
-@bot.command(name="np", aliases=["current", "playing"], help="Show the current playing track.")
+@commands.command(name="np", aliases=["current", "playing"], help="Show the current playing track.")
 async def now_playing(ctx: commands.Context):
     player: wavelink.Player = ctx.voice_client  # Get the current voice client.
     if player and player.playing and player.current:  # Check if there is a current track playing.
-        await ctx.send(embed=make_embed("Now Playing", f"🎶 **{player.current.title}** by **{player.current.author}**"))  # Send an embed with the current track info.
+        send_embed(ctx.channel, make_embed("Now Playing", f"🎶 **{player.current.title}** by **{player.current.author}**"))  # Send an embed with the current track info.
     else:
-        await ctx.send(embed=make_embed("Info", "No track is currently playing."))  # Inform the user if no track is playing.
+        send_embed(ctx.channel, make_embed("Info", "No track is currently playing."))  # Inform the user if no track is playing.
 
 ##############################
 # Command: shuffle
 ##############################
-@bot.command(name="shuffle", help="Shuffle the current queue.")
+@commands.command(name="shuffle", help="Shuffle the current queue.")
 async def shuffle(ctx: commands.Context):
     player: wavelink.Player = ctx.voice_client  # Get the current voice client.
     if player and not player.queue.is_empty:  # Check if the queue is not empty.
         player.queue.shuffle()  # Shuffle the tracks in the queue.
-        await ctx.send(embed=make_embed("Queue Shuffled", "🔀 Shuffled the queue."))  # Send a confirmation embed.
+        schedule_prefetch(player)  # Resolve whatever entries are now at the head of the queue.
+        send_embed(ctx.channel, make_embed("Queue Shuffled", "🔀 Shuffled the queue."))  # Send a confirmation embed.
     else:
-        await ctx.send(embed=make_embed("Error", "Not enough songs in the queue to shuffle.", discord.Color.red()))  # Inform the user if the queue cannot be shuffled.
+        send_embed(ctx.channel, make_embed("Error", "Not enough songs in the queue to shuffle.", discord.Color.red()))  # Inform the user if the queue cannot be shuffled.
 
 ##############################
 # Command: clear_queue
 ##############################
-@bot.command(name="clear_queue", aliases=["cq"], help="Clear all songs from the queue.")
+@commands.command(name="clear_queue", aliases=["cq"], help="Clear all songs from the queue.")
 async def clear_queue(ctx: commands.Context):
     player: wavelink.Player = ctx.voice_client  # Get the current voice client.
     if player:
         player.queue.clear()  # Clear all tracks from the queue.
-        await ctx.send(embed=make_embed("Queue Cleared", "🗑️ Cleared the queue."))  # Send a confirmation embed.
+        cancel_resolution(player)  # Drop searches still pending for this guild.
+        send_embed(ctx.channel, make_embed("Queue Cleared", "🗑️ Cleared the queue."))  # Send a confirmation embed.
     else:
-        await ctx.send(embed=make_embed("Error", "Bot is not connected to a voice channel.", discord.Color.red()))  # Inform the user if the bot is not connected.
+        send_embed(ctx.channel, make_embed("Error", "Bot is not connected to a voice channel.", discord.Color.red()))  # Inform the user if the bot is not connected.
 
 ##############################
 # Command: loop
 ##############################
-@bot.command(name="loop", help="Toggle loop modes (repeat track or entire queue).")
+@commands.command(name="loop", help="Toggle loop modes (repeat track or entire queue).")
 async def loop(ctx: commands.Context):
     player: wavelink.Player = ctx.voice_client  # Get the current voice client.
     if not player:
-        return await ctx.send(embed=make_embed("Error", "Bot is not connected to a voice channel.", discord.Color.red()))  # Inform the user if the bot is not connected.
+        return send_embed(ctx.channel, make_embed("Error", "Bot is not connected to a voice channel.", discord.Color.red()))  # Inform the user if the bot is not connected.
     from wavelink import QueueMode  # Import QueueMode for loop mode options.
     current_mode = player.queue.mode  # Get the current loop mode.
     if current_mode == QueueMode.normal:
         player.queue.mode = QueueMode.loop  # Set loop mode to repeat the current track.
-        await ctx.send(embed=make_embed("Loop Mode", "🔁 Now looping the current track."))  # Send a confirmation embed.
+        send_embed(ctx.channel, make_embed("Loop Mode", "🔁 Now looping the current track."))  # Send a confirmation embed.
     elif current_mode == QueueMode.loop:
         player.queue.mode = QueueMode.loop_all  # Set loop mode to repeat the entire queue.
-        await ctx.send(embed=make_embed("Loop Mode", "🔂 Now looping the entire queue."))  # Send a confirmation embed.
+        send_embed(ctx.channel, make_embed("Loop Mode", "🔂 Now looping the entire queue."))  # Send a confirmation embed.
     elif current_mode == QueueMode.loop_all:
         player.queue.mode = QueueMode.normal  # Disable looping.
-        await ctx.send(embed=make_embed("Loop Mode", "➡️ Looping disabled."))  # Send a confirmation embed.
+        send_embed(ctx.channel, make_embed("Loop Mode", "➡️ Looping disabled."))  # Send a confirmation embed.
+
+##############################
+# Command: stats (admin)
+##############################
+@commands.command(name="stats", help="Show latency and load statistics (bot owner only).")
+@commands.is_owner()
+async def stats(ctx: commands.Context):
+    lines = ["**Commands** (count · avg · p50 · p99)"]
+    for key in sorted(command_latency.series):
+        count, mean, p50, p99 = command_latency.summary(**dict(key))  # Summarize each command.
+        lines.append(f"`{dict(key)['command']}` {count} · {mean * 1000:.0f}ms · {format_bound(p50)} · {format_bound(p99)}")
+    searches = sum(series[-1] for series in search_latency.series.values())  # Total Lavalink searches.
+    search_time = sum(series[-2] for series in search_latency.series.values())  # Total time spent searching.
+    lines.append(f"\n**Lavalink searches:** {searches} · avg {search_time / searches * 1000 if searches else 0:.0f}ms · {search_failures.total():.0f} failed")
+    requests_made = sum(series[-1] for series in spotify_latency.series.values())  # Total Spotify requests.
+    request_time = sum(series[-2] for series in spotify_latency.series.values())  # Total time spent on Spotify.
+    lines.append(f"**Spotify requests:** {requests_made} · avg {request_time / requests_made * 1000 if requests_made else 0:.0f}ms · {spotify_rate_limits.total():.0f} rate limited")
+    _, mean_lag, _, p99_lag = loop_lag.summary()  # Event loop lag so far.
+    lines.append(f"**Event loop lag:** last {last_loop_lag * 1000:.1f}ms · avg {mean_lag * 1000:.1f}ms · p99 {format_bound(p99_lag)}")
+    players = [player for player in bot.voice_clients if isinstance(player, wavelink.Player)]  # Active players in this process.
+    per_node = {}
+    for player in players:
+        per_node[player.node.identifier] = per_node.get(player.node.identifier, 0) + 1  # Count players per node.
+    lines.append(f"**Players:** {len(players)} ({', '.join(f'{node}: {count}' for node, count in per_node.items()) or 'none'}) · {sum(len(player.queue) for player in players)} queued tracks")
+    lines.append(f"**Track cache hit ratio:** {track_cache.hit_ratio():.1%}")
+    lines.append(f"**Startup:** {' · '.join(f'{phase} {seconds:.2f}s' for phase, seconds in startup_phases.items()) or 'in progress'}")
+    send_embed(ctx.channel, make_embed("Stats", "\n".join(lines)))  # Send the statistics embed.
+
+##############################
+# Command: settings
+##############################
+@commands.group(name="settings", invoke_without_command=True, help="Show this server's music settings.")
+async def settings_cmd(ctx: commands.Context):
+    settings = await guild_settings.get(ctx.guild.id)  # Read the guild's settings from the cache.
+    channel = ctx.guild.get_channel(settings["text_channel_id"]) if settings["text_channel_id"] else None  # Configured announcement channel.
+    description = (
+        f"**Volume:** {settings['volume'] if settings['volume'] is not None else 'default'}\n"
+        f"**Text channel:** {channel.mention if channel else 'channel of the command'}"
+    )  # Format the settings for display.
+    send_embed(ctx.channel, make_embed("Settings", description))  # Send the settings embed.
+
+@settings_cmd.command(name="channel", help="Set the channel for music announcements (omit to reset).")
+@commands.has_permissions(manage_guild=True)
+async def settings_channel(ctx: commands.Context, channel: discord.TextChannel = None):
+    await guild_settings.update(ctx.guild.id, text_channel_id=channel.id if channel else None)  # Save the channel, or clear it.
+    player: wavelink.Player = ctx.voice_client  # Get the current voice client.
+    if player and channel:
+        player.text_channel = channel  # Switch announcements right away.
+    send_embed(ctx.channel, make_embed("Settings", f"Music announcements will go to {channel.mention}." if channel else "Music announcements will go to the channel of the command."))  # Send a confirmation embed.
+
+##############################
+# App factory
+##############################
+COMMANDS = (join, leave, volume, play, cache_cmd, pause, resume, stop, skip, queue_cmd, now_playing, shuffle, clear_queue, loop, stats, settings_cmd)  # Every top-level command the bot serves.
+LISTENERS = (on_ready, on_wavelink_node_ready, on_wavelink_node_disconnected, on_wavelink_track_start, on_wavelink_track_end, on_wavelink_inactive_player, on_voice_state_update, on_guild_remove)  # Event handlers, registered under their function names.
+
+def create_bot(spotify=None) -> commands.Bot:
+    """
+    Build the bot and wire up its commands, events and hooks.
+    `spotify` replaces the spotipy client, e.g. with a stub when benchmarking offline.
+    """
+    global bot, sp
+    if spotify is not None:
+        sp = spotify  # Used by every Spotify lookup instead of a real client.
+
+    # Intents setup (ensure "message_content" is enabled in your Developer Portal)
+    intents = discord.Intents.default()  # Get the default intents for the bot.
+    intents.message_content = True  # Enable access to message content (must be enabled in the Developer Portal).
+    intents.voice_states = True  # Enable access to voice state updates.
+    if SHARDED:
+        bot = commands.AutoShardedBot(command_prefix="b!", intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)  # Run several shards in this process.
+    else:
+        bot = commands.Bot(command_prefix="b!", intents=intents)  # Create a new bot instance with specified prefix and intents.
+
+    bot.setup_hook = setup_hook  # Start metrics and launch Lavalink connections after logging in.
+    for listener in LISTENERS:
+        bot.add_listener(listener)  # Register each event handler.
+    bot.before_invoke(start_command_timer)  # Time every command.
+    bot.after_invoke(stop_command_timer)  # Record its latency and errors.
+    bot.add_check(admit_command, call_once=True)  # Rate-limit every command per user and per guild; call_once keeps b!help's per-command checks from spending tokens.
+    bot.on_command_error = on_command_error  # Tell users when they are rate-limited.
+    for command in COMMANDS:
+        bot.add_command(command)  # Register each command with its subcommands.
+    mark_startup("bot_created")  # Everything before login is done.
+    return bot
+
+##############################
+# Cluster launcher
+##############################
+def fetch_recommended_shards() -> int:
+    """Ask Discord how many shards this bot should run."""
+    request = urllib.request.Request("https://discord.com/api/v10/gateway/bot", headers={"Authorization": f"Bot {DISCORD_TOKEN}"})  # Authenticated gateway lookup.
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)["shards"]  # Discord's recommended shard count.
+
+def run_clusters(cluster_count: int, shard_count: int = None):
+    """
+    Split shards into `cluster_count` contiguous ranges, one worker process each, and restart any that crash.
+    Each worker runs this file as an AutoShardedBot with its own SHARD_IDS.
+    """
+    shard_count = shard_count or fetch_recommended_shards()  # Decide how many shards to run in total.
+    cluster_count = max(1, min(cluster_count, shard_count))  # Never start clusters without shards.
+    clusters = [list(range(index * shard_count // cluster_count, (index + 1) * shard_count // cluster_count)) for index in range(cluster_count)]  # Contiguous, evenly sized shard ranges.
+    processes = {}  # Maps cluster index -> running process.
+    restarts = {}  # Maps cluster index -> (restart delay, time the process was started).
+    pending = {}  # Maps cluster index -> time at which a crashed worker is restarted.
+    stopping = False  # Set once the launcher is asked to shut down.
+
+    def start(index: int):
+        env = dict(os.environ, SHARD_COUNT=str(shard_count), SHARD_IDS=",".join(map(str, clusters[index])), CLUSTER_ID=str(index))  # Tell the worker which shards it owns.
+        processes[index] = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)  # Start the worker process.
+        delay = restarts.get(index, (1.0, 0))[0]  # Keep the current backoff delay.
+        restarts[index] = (delay, time.monotonic())  # Remember when it started.
+        print(f"Started cluster {index} with shards {clusters[index][0]}-{clusters[index][-1]} (pid {processes[index].pid}).")  # Log the start.
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True  # Stop restarting workers.
+        for process in processes.values():
+            process.terminate()  # Ask every worker to exit; they flush their settings on SIGTERM.
+
+    signal.signal(signal.SIGINT, shutdown)  # Stop on Ctrl+C.
+    signal.signal(signal.SIGTERM, shutdown)  # Stop when the service manager asks.
+    for index in range(cluster_count):
+        start(index)  # Bring every cluster up.
+    while not stopping:
+        time.sleep(1)  # Check on the workers once a second.
+        now = time.monotonic()
+        for index, process in list(processes.items()):
+            code = process.poll()  # None while the worker is still running.
+            if code is None or stopping or index in pending:
+                continue
+            delay, started = restarts[index]  # Current backoff for this cluster.
+            if now - started > 60:
+                delay = 1.0  # The worker ran for a while, so start over with a short delay.
+            print(f"Cluster {index} exited with code {code}; restarting in {delay:.0f}s.")  # Log the crash.
+            pending[index] = now + delay  # Restart later without holding up the other clusters.
+            restarts[index] = (min(delay * 2, 60.0), started)  # Back off further if it keeps crashing.
+        for index, deadline in list(pending.items()):
+            if now >= deadline and not stopping:
+                del pending[index]
+                start(index)  # Restart the worker.
+    for process in processes.values():
+        process.wait()  # Wait for every worker to exit.
+
+async def run_bot():
+    """Run the bot until it stops, then write any unsaved guild settings."""
+    discord.utils.setup_logging()  # Configure logging the way bot.run would.
+    with contextlib.suppress(NotImplementedError):  # Signal handlers aren't available on Windows.
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(bot.close()))  # Shut down cleanly (and flush settings) when the launcher or service manager asks.
+    async with bot:
+        try:
+            await bot.start(DISCORD_TOKEN)  # Start the bot using the Discord token.
+        finally:
+            await guild_settings.close()  # Flush pending settings before exiting.
 
 # Run the bot
-bot.run(DISCORD_TOKEN)  # Start the bot using the Discord token.
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Discord music bot.")  # Command line for the launcher.
+    parser.add_argument("--clusters", type=int, help="Run the bot as this many worker processes, each with a range of shards.")
+    parser.add_argument("--shards", type=int, help="Total number of shards when clustering (defaults to Discord's recommendation).")
+    args = parser.parse_args()  # Parse the command line.
+    if args.clusters:
+        run_clusters(args.clusters, args.shards)  # Supervise a set of clustered workers.
+    else:
+        create_bot()  # Build the bot; the Spotify client is created on first use.
+        try:
+            asyncio.run(run_bot())  # Run the bot on a fresh event loop.
+        except KeyboardInterrupt:
+            pass  # Ctrl+C is a normal way to stop the bot.
\ No newline at end of file